@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import pandas as pd
+
+from pf_tables_io import BOOLEAN_COLUMNS, CHUNK_SIZE, DATASET_PATH, read_pf_tables
+
+# Aggregates the patient-level population dataset written by
+# dataset_definition_tables.py into one row per combination of demographics and
+# condition flags, with the number of patients in each, so create_tables.R
+# never loads the patient-level file. The dataset is read in typed batches
+# (see pf_tables_io.py), with only the grouped columns, and each batch's counts
+# are added to a running total, so memory is bounded by the batch size and the
+# number of combinations.
+# Run with: python analysis/aggregate_tables.py
+
+COUNTS_PATH = Path("output/population/pf_tables_counts.csv")
+
+DEMOGRAPHIC_COLUMNS = [
+    "has_pf_consultation",
+    "sex",
+    "age_band",
+    "region",
+    "imd",
+    "ethnicity",
+]
+CONDITION_COLUMNS = [
+    "uti_numerator",
+    "sinusitis_numerator",
+    "insectbite_numerator",
+    "otitismedia_numerator",
+    "sorethroat_numerator",
+    "shingles_numerator",
+    "impetigo_numerator",
+]
+GROUP_COLUMNS = DEMOGRAPHIC_COLUMNS + CONDITION_COLUMNS
+
+
+def to_output_values(counts):
+    # As ehrQL writes them: T/F for booleans and empty for missing values
+    for column in GROUP_COLUMNS:
+        values = counts[column].astype(object)
+        if column in BOOLEAN_COLUMNS:
+            values = values.map({True: "T", False: "F"})
+        counts[column] = values.where(values.notna(), "")
+    return counts
+
+
+def count_combinations(path=DATASET_PATH, chunk_size=CHUNK_SIZE):
+    counts = pd.DataFrame(columns=GROUP_COLUMNS + ["n"])
+    for batch in read_pf_tables(path, GROUP_COLUMNS, chunk_size):
+        batch_counts = batch.groupby(GROUP_COLUMNS, observed=True, dropna=False).size()
+        # Categories differ between batches, so counts are combined as strings
+        batch_counts = to_output_values(batch_counts.reset_index(name="n"))
+        counts = (
+            pd.concat([counts, batch_counts], ignore_index=True)
+            .groupby(GROUP_COLUMNS, sort=False)["n"]
+            .sum()
+            .reset_index()
+        )
+    return counts.astype({"n": "int64"}).sort_values(GROUP_COLUMNS, ignore_index=True)
+
+
+def main():
+    counts = count_combinations()
+    COUNTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    counts.to_csv(COUNTS_PATH, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+# Per-patient change-point index for the "value as of a date" lookups the
+# definitions make for every interval: practice_registrations.for_patient_on,
+# addresses.for_patient_on and the latest ethnicity code. The rows that could
+# be picked only change on a start_date, the day after an end_date or an event
+# date, so the pick is resolved once at each of those change points, and any
+# number of (patient, date) lookups is then a single searchsorted on sorted
+# (patient position, day) keys.
+
+# Dates are stored as days since 1970-01-01, offset so they are never negative
+# and packed with the patient position into a single sortable int64 key
+DAY_OFFSET = 1 << 31
+
+
+def to_days(dates):
+    return (
+        pd.DatetimeIndex(dates).normalize().to_numpy("datetime64[D]").astype(np.int64)
+    )
+
+
+class AsOfIndex:
+    def __init__(self, patient_ids, days, rows, values):
+        """
+        rows[i] is the row of values picked from day days[i] of patient
+        patient_ids[i] until the patient's next change point (-1 for none)
+        """
+        patient_ids = np.asarray(patient_ids, dtype=np.int64)
+        self.patient_ids = np.unique(patient_ids)
+        positions = np.searchsorted(self.patient_ids, patient_ids)
+        keys = self._pack(positions, np.asarray(days, dtype=np.int64))
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.rows = np.asarray(rows, dtype=np.int64)[order]
+        self.values = values.reset_index(drop=True)
+
+    @classmethod
+    def from_spans(
+        cls,
+        table,
+        start_column="start_date",
+        end_column="end_date",
+        prefer_column=None,
+    ):
+        """
+        Index of table.for_patient_on(date) as ehrQL evaluates it: rows with
+        start_date on or before the date and no end_date before it, the most
+        recent start, then the latest end (a missing end_date counts as latest).
+        Rows where prefer_column is true are picked over the rest, as
+        addresses.for_patient_on prefers has_postcode.
+        Values are all the columns of table except patient_id.
+        """
+        table = table.reset_index(drop=True)
+        spans = table[table[start_column].notna()]
+        ends = spans[spans[end_column].notna()]
+        change_points = pd.DataFrame(
+            {
+                "patient_id": np.concatenate(
+                    [spans["patient_id"].to_numpy(), ends["patient_id"].to_numpy()]
+                ),
+                "_day": np.concatenate(
+                    [to_days(spans[start_column]), to_days(ends[end_column]) + 1]
+                ),
+            }
+        ).drop_duplicates()
+
+        # Each change point against every span of the patient, picking as
+        # IntervalGrid.for_patient_on did for each grid row
+        candidates = change_points.merge(
+            pd.DataFrame(
+                {
+                    "patient_id": spans["patient_id"].to_numpy(),
+                    "_row": spans.index.to_numpy(),
+                    "_start": to_days(spans[start_column]),
+                    "_end": to_days(spans[end_column].fillna(spans[start_column])),
+                    "_open_ended": spans[end_column].isna().to_numpy(),
+                    "_preferred": (
+                        spans[prefer_column].fillna(False).to_numpy(bool)
+                        if prefer_column
+                        else False
+                    ),
+                }
+            ),
+            on="patient_id",
+        )
+        candidates = candidates[
+            (candidates["_start"] <= candidates["_day"])
+            & (candidates["_open_ended"] | (candidates["_end"] >= candidates["_day"]))
+        ]
+        picked = (
+            candidates.sort_values(
+                ["patient_id", "_day", "_preferred", "_start", "_open_ended", "_end"],
+                kind="stable",
+            )
+            .drop_duplicates(["patient_id", "_day"], keep="last")
+            .set_index(["patient_id", "_day"])["_row"]
+        )
+        # Change points where every span has ended pick nothing
+        rows = picked.reindex(
+            pd.MultiIndex.from_frame(change_points), fill_value=-1
+        ).to_numpy()
+        return cls(
+            change_points["patient_id"],
+            change_points["_day"],
+            rows,
+            table.drop(columns="patient_id"),
+        )
+
+    @classmethod
+    def from_events(cls, events, column, date_column="date"):
+        """
+        Index of events.where(events.date.is_on_or_before(date))
+        .sort_by(events.date).last_for_patient().column; of events on the same
+        date, the last in events is picked
+        """
+        events = events[events[date_column].notna()].reset_index(drop=True)
+        days = to_days(events[date_column])
+        last = (
+            ~pd.DataFrame({"patient_id": events["patient_id"].to_numpy(), "_day": days})
+            .duplicated(keep="last")
+            .to_numpy()
+        )
+        return cls(
+            events["patient_id"][last],
+            days[last],
+            np.flatnonzero(last),
+            events[[column]],
+        )
+
+    @staticmethod
+    def _pack(positions, days):
+        return (positions.astype(np.int64) << 32) | (days + DAY_OFFSET)
+
+    def _positions(self, patient_ids):
+        positions = np.searchsorted(self.patient_ids, patient_ids)
+        known = positions < len(self.patient_ids)
+        known[known] = self.patient_ids[positions[known]] == patient_ids[known]
+        return positions, known
+
+    def lookup_rows(self, patient_ids, dates):
+        # Row of values picked for each (patient_id, date), or -1
+        patient_ids = np.asarray(patient_ids, dtype=np.int64)
+        positions, known = self._positions(patient_ids)
+        if not len(self.keys):
+            return np.full(len(patient_ids), -1)
+        found = (
+            np.searchsorted(
+                self.keys, self._pack(positions, to_days(dates)), side="right"
+            )
+            - 1
+        )
+        clipped = found.clip(0)
+        valid = known & (found >= 0) & ((self.keys[clipped] >> 32) == positions)
+        return np.where(valid, self.rows[clipped], -1)
+
+    def on(self, patient_ids, dates):
+        """
+        The values picked for each (patient_id, date), with an exists column;
+        values are missing where nothing is picked
+        """
+        rows = self.lookup_rows(patient_ids, dates)
+        result = self.values.reindex(rows).reset_index(drop=True)
+        result["exists"] = rows >= 0
+        return result
@@ -0,0 +1,206 @@
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import re
+import shlex
+import subprocess
+import sys
+from pathlib import Path
+
+import yaml
+
+# Content-hash cache keys for the actions in project.yaml, for skipping
+# actions whose inputs have not changed when running the project locally.
+#
+# An action's key is a hash of its run command and of every repo file it
+# depends on: the script or definition file, its transitive imports from
+# analysis/ (config, codelists, pf_dataset, pf_variables_library, ...), the
+# codelist CSVs those files reference, R files sourced with here(...), dummy
+# tables and data files named on the command line, and the keys of the actions
+# it needs. Keys are stored next to the outputs in output/build_cache/.
+#
+# Run with:
+#   python analysis/build_cache.py status
+#   python analysis/build_cache.py run [ACTION ...]
+
+PROJECT_FILE = Path("project.yaml")
+ANALYSIS_DIR = Path("analysis")
+CACHE_DIR = Path("output/build_cache")
+
+SCRIPT_PATTERN = re.compile(r"^(analysis|reports|lib)/\S+\.(py|R|Rmd)$")
+CODELIST_PATTERN = re.compile(r"codelists/[\w.-]+\.csv")
+R_HERE_PATTERN = re.compile(r"here(?:::here)?\(([^)]*)\)")
+DATA_OPTIONS = ["--dummy-tables", "--dummy-data-file", "--test-data-file"]
+
+
+def load_actions(project_file=PROJECT_FILE):
+    return yaml.safe_load(project_file.read_text())["actions"]
+
+
+def hash_file(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def get_run_args(action):
+    return shlex.split(action["run"].replace("\n", " "))
+
+
+def get_python_imports(path):
+    """Files in analysis/ imported by path, directly or as analysis.<module>"""
+    tree = ast.parse(Path(path).read_text(), filename=str(path))
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.add(node.module)
+    imports = set()
+    for module in modules:
+        module = module.removeprefix("analysis.")
+        candidate = ANALYSIS_DIR / f"{module.replace('.', '/')}.py"
+        if candidate.exists():
+            imports.add(candidate)
+    return imports
+
+
+def get_r_sources(path):
+    # Repo files referenced with here("lib", "functions", "x.R") and similar
+    sources = set()
+    for match in R_HERE_PATTERN.finditer(Path(path).read_text()):
+        parts = re.findall(r"\"([^\"]+)\"", match.group(1))
+        candidate = Path(*parts) if parts else None
+        if (
+            candidate is not None
+            and candidate.parts[0] != "output"
+            and candidate.is_file()
+        ):
+            sources.add(candidate)
+    return sources
+
+
+def get_source_files(script):
+    """The script and every repo file it reads code or codelists from"""
+    files = set()
+    pending = [Path(script)]
+    while pending:
+        path = pending.pop()
+        if path in files:
+            continue
+        files.add(path)
+        if path.suffix == ".py":
+            pending.extend(get_python_imports(path))
+            files.update(
+                Path(codelist)
+                for codelist in CODELIST_PATTERN.findall(path.read_text())
+            )
+        elif path.suffix in [".R", ".Rmd"]:
+            pending.extend(get_r_sources(path))
+    return files
+
+
+def get_input_files(action):
+    args = get_run_args(action)
+    files = set()
+    for arg in args:
+        if SCRIPT_PATTERN.match(arg) and Path(arg).exists():
+            files.update(get_source_files(arg))
+        # Scripts named inside an R expression, e.g. rmarkdown::render("reports/x.Rmd")
+        for script in re.findall(r"\"((?:analysis|reports)/[^\"]+)\"", arg):
+            if Path(script).exists():
+                files.update(get_source_files(script))
+    for option, value in zip(args, args[1:]):
+        if option in DATA_OPTIONS:
+            path = Path(value)
+            if path.is_dir():
+                files.update(p for p in path.rglob("*") if p.is_file())
+            elif path.exists():
+                files.add(path)
+    return files
+
+
+def get_cache_keys(actions):
+    """Cache key of every action, including the keys of the actions it needs"""
+    keys = {}
+
+    def get_key(name):
+        if name not in keys:
+            action = actions[name]
+            digest = hashlib.sha256()
+            digest.update(action["run"].encode())
+            for path in sorted(get_input_files(action)):
+                digest.update(f"{path.as_posix()}:{hash_file(path)}".encode())
+            for need in action.get("needs", []):
+                digest.update(f"{need}:{get_key(need)}".encode())
+            keys[name] = digest.hexdigest()
+        return keys[name]
+
+    for name in actions:
+        get_key(name)
+    return keys
+
+
+def get_output_patterns(action):
+    return [
+        pattern
+        for outputs in action.get("outputs", {}).values()
+        for pattern in outputs.values()
+    ]
+
+
+def is_fresh(name, action, key, cache_dir=CACHE_DIR):
+    cache_file = cache_dir / f"{name}.json"
+    if not cache_file.exists():
+        return False
+    if json.loads(cache_file.read_text()).get("key") != key:
+        return False
+    return all(glob.glob(pattern) for pattern in get_output_patterns(action))
+
+
+def record_key(name, key, cache_dir=CACHE_DIR):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / f"{name}.json").write_text(json.dumps({"key": key}, indent=2))
+
+
+def get_run_order(actions, selected):
+    # Selected actions and everything they need, dependencies first
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        for need in actions[name].get("needs", []):
+            visit(need)
+        order.append(name)
+
+    for name in selected:
+        visit(name)
+    return order
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["status", "run"])
+    parser.add_argument("actions", nargs="*", help="Defaults to every action")
+    args = parser.parse_args()
+
+    actions = load_actions()
+    unknown = set(args.actions) - set(actions)
+    if unknown:
+        sys.exit(f"Unknown actions: {', '.join(sorted(unknown))}")
+    keys = get_cache_keys(actions)
+
+    for name in get_run_order(actions, args.actions or list(actions)):
+        fresh = is_fresh(name, actions[name], keys[name])
+        if args.command == "status":
+            print(f"{'fresh' if fresh else 'stale'}  {name}")
+        elif fresh:
+            print(f"Skipping {name}: inputs unchanged")
+        else:
+            subprocess.run(["opensafely", "run", name], check=True)
+            record_key(name, keys[name])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# Codelists compiled to sorted int64 arrays for vectorised membership tests on
+# whole columns of event data (e.g. the dummy_tables CSVs or the partitioned
+# extract), instead of comparing long SNOMED CT / dm+d digit strings.
+# SNOMED CT and dm+d codes have at most 18 digits, so they fit in int64.
+
+MAX_CODE_DIGITS = 18
+
+
+def encode_codes(values):
+    """
+    Encode a column of codes as int64. Returns (codes, valid), where valid is
+    False for missing values and anything that is not a code of digits.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values.dtype) and not values.hasnans:
+        return values.to_numpy(np.int64), np.ones(len(values), dtype=bool)
+
+    strings = values.astype("string").str.strip()
+    valid = (
+        strings.str.fullmatch(rf"\d{{1,{MAX_CODE_DIGITS}}}")
+        .fillna(False)
+        .to_numpy(bool)
+    )
+    codes = np.zeros(len(values), dtype=np.int64)
+    codes[valid] = strings[valid].astype("int64").to_numpy()
+    return codes, valid
+
+
+class CodeArray:
+    def __init__(self, codes, categories=None):
+        # codes: any iterable of codes, as strings or integers
+        # categories: optional mapping of code to category, as given by
+        # codelist_from_csv with a category_column
+        codes = [str(code).strip() for code in codes]
+        encoded, valid = encode_codes(codes)
+        if not valid.all():
+            invalid = [code for code, ok in zip(codes, valid) if not ok]
+            raise ValueError(f"Codes must be digit strings, got {invalid[:5]}")
+
+        self.codes, first_positions = np.unique(encoded, return_index=True)
+        self.categories = None
+        if categories is not None:
+            categories = {
+                str(code).strip(): value for code, value in categories.items()
+            }
+            self.categories = np.array(
+                [categories[codes[position]] for position in first_positions],
+                dtype=object,
+            )
+
+    @classmethod
+    def from_codelist(cls, codelist):
+        # Accepts the lists and code-to-category dicts defined in codelists.py
+        if isinstance(codelist, CodeArray):
+            return codelist
+        if isinstance(codelist, dict):
+            return cls(list(codelist), categories=codelist)
+        return cls(list(codelist))
+
+    @classmethod
+    def from_csv(cls, filename, column, category_column=None):
+        table = pd.read_csv(filename, dtype=str)
+        codes = table[column].dropna().str.strip()
+        if category_column is None:
+            return cls(codes)
+        categories = dict(zip(codes, table.loc[codes.index, category_column]))
+        return cls(codes, categories=categories)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return bool(self.isin([code])[0])
+
+    def __iter__(self):
+        return (str(code) for code in self.codes)
+
+    def _positions(self, values):
+        encoded, valid = encode_codes(values)
+        positions = np.searchsorted(self.codes, encoded)
+        found = valid & (positions < len(self.codes))
+        found[found] = self.codes[positions[found]] == encoded[found]
+        return positions, found
+
+    def isin(self, values):
+        """Boolean array: whether each value in values is in the codelist"""
+        return self._positions(values)[1]
+
+    def to_category(self, values):
+        """Category of each value in values, or None if it is not in the codelist"""
+        if self.categories is None:
+            raise ValueError("Codelist has no categories")
+        positions, found = self._positions(values)
+        result = np.full(len(found), None, dtype=object)
+        result[found] = self.categories[positions[found]]
+        return result
+
+    def __add__(self, other):
+        other = CodeArray.from_codelist(other)
+        return CodeArray(list(self) + list(other))
@@ -98,3 +98,11 @@ otitismedia_code = ["3110003"]
 sorethroat_code = ["363746003"]
 shingles_code = ["4740000"]
 impetigo_code = ["48277006"]
+
+
+# Compile any of the codelists above to a CodeArray (sorted int64 codes) for
+# vectorised membership tests in local evaluation, e.g. as_code_array(pf_med_codelist)
+def as_code_array(codelist):
+    from codelist_arrays import CodeArray
+
+    return CodeArray.from_codelist(codelist)
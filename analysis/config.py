@@ -8,6 +8,12 @@ index_date_dataset_tables = "2025-01-31"
 start_date_measure_condition_provider = "2023-01-01"
 monthly_intervals_measure_condition_provider = 25
 
+# Dataset definition: dataset_definition_extract.py
+# Starts 12 months before start_date_measure_condition_provider to cover the
+# 6 and 12 month recurrence windows
+# Timeframe: 01/01/2022 onwards
+start_date_extract = "2022-01-01"
+
 # Number of months included in the monthly dashboard - INCREASE THIS INTERVAL BY ONE EACH MONTH
 # Current timeframe of monthly dashboard: 01/11/2023 - 31/03/2026 (UPDATE this timeframe monthly)
 monthly_dashboard_intervals = 29
@@ -23,3 +29,8 @@ monthly_intervals_measure_descriptive_stats = monthly_dashboard_intervals
 # Measure: measures_definition_pf_consultation_pf_counts.py
 start_date_measure_med_counts = "2023-11-01"
 monthly_intervals_measure_med_counts = monthly_dashboard_intervals
+
+# Dataset definition: dataset_definition_pf_consultations.py
+# Covers the intervals of the breakdown, descriptive stats and med counts measures
+start_date_pf_consultations = "2023-11-01"
+monthly_intervals_pf_consultations = monthly_dashboard_intervals
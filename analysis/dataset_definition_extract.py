@@ -0,0 +1,70 @@
+from ehrql import create_dataset
+from ehrql.tables.tpp import (
+    patients,
+    clinical_events,
+    practice_registrations,
+)
+from ehrql.tables.raw.tpp import medications
+
+from config import start_date_extract
+from pf_variables_library import select_events
+import codelists
+
+# Pre-extraction of the rows of clinical_events and medications that the
+# definition files use, written as event-level tables for extract_events.py
+
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+recent_events = clinical_events.where(
+    clinical_events.date.is_on_or_after(start_date_extract)
+)
+pf_ids = select_events(
+    recent_events,
+    codelist=codelists.pf_consultation_events_dict["pf_consultation_services_combined"],
+).consultation_id
+
+# Pharmacy First services, clinical pathway conditions and pregnancy codes
+extract_codes = (
+    codelists.pf_consultation_events_dict["pf_consultation_services_combined"]
+    + list(codelists.pf_conditions_codelist)
+    + list(codelists.pregnancy_codelist)
+)
+
+# Ethnicity uses the latest code in the whole record, so these codes are kept
+# regardless of date. Other events linked to a Pharmacy First consultation are
+# kept for the descriptive stats counts.
+extract_events = clinical_events.where(
+    (
+        clinical_events.date.is_on_or_after(start_date_extract)
+        & (
+            clinical_events.snomedct_code.is_in(extract_codes)
+            | clinical_events.consultation_id.is_in(pf_ids)
+        )
+    )
+    | clinical_events.snomedct_code.is_in(codelists.ethnicity_group16_codelist)
+)
+
+# All medications used by the definitions are linked to a Pharmacy First consultation
+extract_medications = medications.where(
+    medications.date.is_on_or_after(start_date_extract)
+    & medications.consultation_id.is_in(pf_ids)
+)
+
+dataset.sex = patients.sex
+dataset.date_of_birth = patients.date_of_birth
+
+dataset.add_event_table(
+    "clinical_events",
+    consultation_id=extract_events.consultation_id,
+    date=extract_events.date,
+    snomedct_code=extract_events.snomedct_code,
+)
+dataset.add_event_table(
+    "medications",
+    consultation_id=extract_medications.consultation_id,
+    date=extract_medications.date,
+    dmd_code=extract_medications.dmd_code,
+)
+
+dataset.define_population(practice_registrations.exists_for_patient())
@@ -0,0 +1,98 @@
+import argparse
+from datetime import date, timedelta
+
+from ehrql import create_dataset
+from ehrql.tables.raw.tpp import medications
+from ehrql.tables.tpp import (
+    patients,
+    clinical_events,
+    practice_registrations,
+    addresses,
+    ethnicity_from_sus,
+)
+
+from config import (
+    start_date_measure_condition_provider,
+    start_date_measure_pf_breakdown,
+    monthly_intervals_measure_pf_breakdown,
+)
+from measure_shards import add_months
+from pf_dataset import get_latest_ethnicity
+from pf_variables_library import select_events
+import codelists
+
+# Dataset definition used only to create dummy tables for the
+# measures_definition_pf_*.py files with dummy_data_cache.py, as ehrQL can only
+# create dummy tables from a dataset definition. It references the tables,
+# codelists and date range of the measures definitions so that the dummy
+# tables have registered patients with Pharmacy First consultations, linked
+# conditions and medications, ethnicity codes and addresses, and is not run
+# against real data.
+#
+# The population size is that of the measures definition, passed with
+#   -- --population-size N
+
+
+def parse_population_size():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--population-size", type=int, default=1000)
+    args, _ = parser.parse_known_args()
+    return args.population_size
+
+
+# From the earliest measures interval to the end of the dashboard period
+start_date = start_date_measure_condition_provider
+end_date = (
+    date.fromisoformat(
+        add_months(
+            start_date_measure_pf_breakdown, monthly_intervals_measure_pf_breakdown
+        )
+    )
+    - timedelta(days=1)
+).isoformat()
+
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=parse_population_size())
+
+registration = practice_registrations.for_patient_on(end_date)
+selected_events = clinical_events.where(
+    clinical_events.date.is_on_or_between(start_date, end_date)
+)
+pf_consultation_events = select_events(
+    selected_events,
+    codelist=codelists.pf_consultation_events_dict["pf_consultation_services_combined"],
+)
+pf_ids = pf_consultation_events.consultation_id
+pf_condition_events = select_events(
+    selected_events,
+    codelist=codelists.pf_conditions_codelist,
+    consultation_ids=pf_ids,
+)
+pf_medications = select_events(
+    medications,
+    consultation_ids=pf_ids,
+    start_date=start_date,
+    end_date=end_date,
+)
+first_pf_medication = pf_medications.sort_by(pf_medications.date).first_for_patient()
+
+dataset.sex = patients.sex
+dataset.age = patients.age_on(start_date)
+dataset.region = registration.practice_nuts1_region_name
+dataset.imd = addresses.for_patient_on(start_date).imd_rounded
+dataset.ethnicity = get_latest_ethnicity(
+    end_date,
+    clinical_events,
+    codelists.ethnicity_group6_codelist,
+    ethnicity_from_sus,
+)
+dataset.pf_consultation_count = pf_consultation_events.count_for_patient()
+dataset.pf_condition_count = pf_condition_events.count_for_patient()
+dataset.first_pf_medication = first_pf_medication.dmd_code
+dataset.first_pf_medication_is_pf = first_pf_medication.dmd_code.is_in(
+    codelists.pf_med_codelist
+)
+
+dataset.define_population(
+    registration.exists_for_patient() & patients.sex.is_in(["male", "female"])
+)
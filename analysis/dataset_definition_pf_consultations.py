@@ -0,0 +1,108 @@
+from datetime import date, timedelta
+
+from ehrql import case, create_dataset, when
+from ehrql.tables.tpp import (
+    addresses,
+    clinical_events,
+    ethnicity_from_sus,
+    patients,
+    practice_registrations,
+)
+from ehrql.tables.raw.tpp import medications
+
+from config import start_date_pf_consultations, monthly_intervals_pf_consultations
+from measure_shards import add_months
+from pf_variables_library import select_events
+import codelists
+
+# Event-level export of Pharmacy First consultations for patients with one in
+# the dashboard period: the events and medications linked to each consultation,
+# with their Pharmacy First service, condition and medication already
+# categorised, and the registration, address and ethnicity records needed for
+# the demographic breakdowns. pf_consultations.py turns this into one row per
+# consultation and computes the measures locally, so new breakdowns do not
+# need a new measures definition.
+
+start_date = start_date_pf_consultations
+end_date = (
+    date.fromisoformat(add_months(start_date, monthly_intervals_pf_consultations))
+    - timedelta(days=1)
+).isoformat()
+
+dataset = create_dataset()
+dataset.configure_dummy_data(population_size=1000)
+
+pf_services_codes = codelists.pf_consultation_events_dict[
+    "pf_consultation_services_combined"
+]
+
+# As in measures_definition_pf_breakdown.py, events are linked to Pharmacy
+# First consultations recorded on any date
+pf_ids = select_events(clinical_events, codelist=pf_services_codes).consultation_id
+
+selected_events = select_events(
+    clinical_events, start_date=start_date, end_date=end_date
+)
+consultation_events = selected_events.where(
+    selected_events.snomedct_code.is_in(pf_services_codes)
+    | selected_events.consultation_id.is_in(pf_ids)
+)
+consultation_medications = select_events(
+    medications, consultation_ids=pf_ids, start_date=start_date, end_date=end_date
+)
+ethnicity_events = clinical_events.where(
+    clinical_events.snomedct_code.is_in(codelists.ethnicity_group6_codelist)
+)
+
+service = case(
+    *[
+        when(consultation_events.snomedct_code.is_in(codes)).then(service_name)
+        for service_name, codes in codelists.pf_consultation_events_dict.items()
+        if service_name != "pf_consultation_services_combined"
+    ]
+)
+
+dataset.sex = patients.sex
+dataset.date_of_birth = patients.date_of_birth
+dataset.ethnicity_from_sus = ethnicity_from_sus.code
+
+dataset.add_event_table(
+    "consultation_events",
+    consultation_id=consultation_events.consultation_id,
+    date=consultation_events.date,
+    service=service,
+    condition=consultation_events.snomedct_code.to_category(
+        codelists.pf_conditions_codelist
+    ),
+)
+dataset.add_event_table(
+    "consultation_medications",
+    consultation_id=consultation_medications.consultation_id,
+    date=consultation_medications.date,
+    dmd_code=consultation_medications.dmd_code,
+    pf_medication=consultation_medications.dmd_code.is_in(codelists.pf_med_codelist),
+)
+dataset.add_event_table(
+    "ethnicity_events",
+    date=ethnicity_events.date,
+    ethnicity=ethnicity_events.snomedct_code.to_category(
+        codelists.ethnicity_group6_codelist
+    ),
+)
+dataset.add_event_table(
+    "practice_registrations",
+    start_date=practice_registrations.start_date,
+    end_date=practice_registrations.end_date,
+    practice_nuts1_region_name=practice_registrations.practice_nuts1_region_name,
+)
+dataset.add_event_table(
+    "addresses",
+    start_date=addresses.start_date,
+    end_date=addresses.end_date,
+    has_postcode=addresses.has_postcode,
+    imd_rounded=addresses.imd_rounded,
+)
+
+dataset.define_population(
+    select_events(selected_events, codelist=pf_services_codes).exists_for_patient()
+)
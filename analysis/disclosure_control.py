@@ -0,0 +1,238 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from merge_measures import expand_paths
+
+# Uniform disclosure control for the moderately sensitive measures and table
+# outputs, so they do not each rely on their own handling. As ehrQL's
+# configure_disclosure_control, counts of --threshold (7) or fewer are
+# suppressed and the rest rounded to the nearest --rounding (5). Where that
+# suppresses a single count in a group, the next smallest count in the group
+# is suppressed too, so the suppressed count cannot be recovered from the
+# group's total. Groups are:
+#   - measures outputs: the rows of a measure and interval, for each of the
+#     numerator and denominator. Suppressed counts are written as 0, as ehrQL
+#     does, and ratios are recomputed from the rounded counts
+#   - the long tables written by create_tables.R (table, population,
+#     category, subcategory, metric, value): the n and numerator rows of a
+#     table, population and category. Suppressed rows are left out, as
+#     create_tables.R does, and percentages are recomputed
+# Files are read in chunks, and the rows of a group must be next to each other
+# (measures outputs are ordered by measure and then interval). Outputs keep
+# their path under output/ (or their directory and file name, for files
+# elsewhere) under --output-dir.
+#
+# Run with:
+#   python analysis/disclosure_control.py "output/measures/*.csv" output/population/pf_tables.csv
+
+OUTPUT_DIR = Path("output/disclosure_control")
+CHUNK_SIZE = 1_000_000
+SMALL_NUMBER_THRESHOLD = 7
+ROUNDING = 5
+
+MEASURES_GROUP_COLUMNS = ["measure", "interval_start", "interval_end"]
+MEASURES_COUNT_COLUMNS = ["numerator", "denominator"]
+TABLES_GROUP_COLUMNS = ["table", "population", "category"]
+TABLES_COUNT_METRICS = ["n", "numerator"]
+
+
+def round_counts(values, threshold=SMALL_NUMBER_THRESHOLD, rounding=ROUNDING):
+    """
+    Counts of threshold or fewer as 0, and the rest rounded to the nearest
+    multiple of rounding (halves up). Missing values are kept.
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.floor(values / rounding + 0.5) * rounding
+    return np.where(values <= threshold, 0, rounded)
+
+
+def get_suppressed(values, groups, threshold=SMALL_NUMBER_THRESHOLD):
+    """
+    Mask of the counts to suppress: non-zero counts of threshold or fewer
+    and, in groups where that is a single count, the smallest count above the
+    threshold. groups numbers each row's group from 0.
+    """
+    values = np.asarray(values, dtype=float)
+    groups = np.asarray(groups)
+    primary = (values > 0) & (values <= threshold)
+    if not len(values):
+        return primary
+    n_groups = groups.max() + 1
+    candidates = values > threshold
+    needs_secondary = (
+        np.bincount(groups, weights=primary, minlength=n_groups) == 1
+    ) & (np.bincount(groups, weights=candidates, minlength=n_groups) > 0)
+
+    # The first row of each group, ordered by value with non-candidates last
+    order = np.lexsort((np.where(candidates, values, np.inf), groups))
+    first = order[np.r_[True, groups[order][1:] != groups[order][:-1]]]
+    first = first[candidates[first] & needs_secondary[groups[first]]]
+    secondary = np.zeros(len(values), dtype=bool)
+    secondary[first] = True
+    return primary | secondary
+
+
+def to_numeric(values):
+    return pd.to_numeric(values.replace("", np.nan)).to_numpy(dtype=float)
+
+
+def to_counts(values):
+    # Integer counts, keeping missing values empty
+    return pd.array(values, dtype="Int64")
+
+
+def control_measures(chunk, threshold=SMALL_NUMBER_THRESHOLD, rounding=ROUNDING):
+    groups = chunk.groupby(MEASURES_GROUP_COLUMNS, sort=False).ngroup().to_numpy()
+    controlled = {}
+    for column in MEASURES_COUNT_COLUMNS:
+        values = to_numeric(chunk[column])
+        suppressed = get_suppressed(values, groups, threshold)
+        controlled[column] = np.where(
+            suppressed, 0, round_counts(values, threshold, rounding)
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = controlled["numerator"] / controlled["denominator"]
+    ratio[controlled["denominator"] == 0] = np.nan
+    return chunk.assign(
+        ratio=ratio,
+        **{column: to_counts(values) for column, values in controlled.items()},
+    )
+
+
+def control_tables(chunk, threshold=SMALL_NUMBER_THRESHOLD, rounding=ROUNDING):
+    is_count = chunk["metric"].isin(TABLES_COUNT_METRICS).to_numpy()
+    counts = chunk[is_count]
+    values = to_numeric(counts["value"])
+    groups = counts.groupby(TABLES_GROUP_COLUMNS, sort=False).ngroup().to_numpy()
+    suppressed = get_suppressed(values, groups, threshold)
+    counts = counts[~suppressed].assign(
+        value=to_counts(round_counts(values[~suppressed], threshold, rounding)).astype(
+            object
+        ),
+        _position=np.flatnonzero(is_count)[~suppressed],
+    )
+
+    # Percentages of the category, after each n, for tables that have them
+    tables_with_pct = chunk.loc[chunk["metric"] == "pct", "table"].unique()
+    n = counts[(counts["metric"] == "n") & counts["table"].isin(tables_with_pct)]
+    category_totals = n.groupby(TABLES_GROUP_COLUMNS, sort=False)["value"].transform(
+        "sum"
+    )
+    pct = n.assign(
+        metric="pct",
+        value=(n["value"] / category_totals).astype(float).round(4).astype(object),
+        _position=n["_position"] + 0.5,
+    )
+    return (
+        pd.concat([counts, pct])
+        .sort_values("_position", kind="stable")
+        .drop(columns="_position")
+    )
+
+
+def control_in_chunks(
+    path,
+    output_path,
+    control,
+    group_columns,
+    chunk_size=CHUNK_SIZE,
+    **kwargs,
+):
+    """
+    Write the output of control for the rows of path, a chunk at a time. The
+    last group of each chunk is held back until the next, so control always
+    sees whole groups.
+    """
+    chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    written = False
+    seen = set()
+    carried = None
+
+    def write(rows):
+        nonlocal written
+        control(rows, **kwargs).to_csv(
+            output_path, mode="a" if written else "w", header=not written, index=False
+        )
+        written = True
+
+    for chunk in chunks:
+        if carried is not None:
+            chunk = pd.concat([carried, chunk])
+        if not len(chunk):
+            continue
+        keys = chunk[group_columns]
+        is_last = (keys == keys.iloc[-1]).all(axis=1).to_numpy()
+        carried = chunk[is_last]
+        chunk = chunk[~is_last]
+        if not len(chunk):
+            continue
+        group_keys = set(keys[~is_last].drop_duplicates().itertuples(index=False))
+        groups = chunk.groupby(group_columns, sort=False).ngroup().to_numpy()
+        if (
+            (np.diff(groups) < 0).any()
+            or not is_last[np.argmax(is_last) :].all()
+            or seen & group_keys
+        ):
+            raise ValueError(
+                f"Rows of each {', '.join(group_columns)} group in {path} "
+                "must be next to each other"
+            )
+        seen |= group_keys
+        write(chunk)
+    if carried is not None and len(carried):
+        if tuple(carried[group_columns].iloc[0]) in seen:
+            raise ValueError(
+                f"Rows of each {', '.join(group_columns)} group in {path} "
+                "must be next to each other"
+            )
+        write(carried)
+    if not written:
+        pd.read_csv(path, nrows=0).to_csv(output_path, index=False)
+
+
+def get_output_path(path, output_dir=OUTPUT_DIR):
+    # output/pf_consultations/measures/ and output/measures/ share file names
+    path = Path(path)
+    if path.parts[0] == "output":
+        return Path(output_dir) / path.relative_to("output")
+    return Path(output_dir) / path.parent.name / path.name
+
+
+def get_format(path):
+    header = pd.read_csv(path, nrows=0).columns
+    if set(MEASURES_GROUP_COLUMNS + MEASURES_COUNT_COLUMNS) <= set(header):
+        return control_measures, MEASURES_GROUP_COLUMNS
+    if set(TABLES_GROUP_COLUMNS + ["metric", "value"]) <= set(header):
+        return control_tables, TABLES_GROUP_COLUMNS
+    raise ValueError(f"{path} is neither a measures output nor a table output")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outputs", nargs="+", help="Output files or glob patterns")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--threshold", type=int, default=SMALL_NUMBER_THRESHOLD)
+    parser.add_argument("--rounding", type=int, default=ROUNDING)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    for path in expand_paths(args.outputs):
+        control, group_columns = get_format(path)
+        output_path = get_output_path(path, args.output_dir)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        control_in_chunks(
+            path,
+            output_path,
+            control,
+            group_columns,
+            args.chunk_size,
+            threshold=args.threshold,
+            rounding=args.rounding,
+        )
+
+
+if __name__ == "__main__":
+    main()
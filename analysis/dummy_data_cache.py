@@ -0,0 +1,163 @@
+import argparse
+import ast
+import hashlib
+import shutil
+import subprocess
+from pathlib import Path
+
+from build_cache import get_source_files
+
+# Cache of the dummy tables ehrQL generates for a dataset or measures
+# definition, so repeat local runs skip dummy data generation.
+#
+# Tables are generated once with ehrQL's create-dummy-tables and stored under
+# output/dummy_data_cache/<definition>/<population size>-<hash>/. The hash is
+# structural: Python files are hashed by their syntax tree (so comments and
+# formatting do not count) together with the codelists they reference, so any
+# change to the definition, its imports or its codelists invalidates the cache.
+#
+# create-dummy-tables only loads dataset definitions, so the tables for a
+# measures definition are created from dataset_definition_measures_dummy_tables.py
+# at the population size of the measures definition's configure_dummy_data,
+# and that dataset definition is part of the hash.
+#
+# Run with:
+#   python analysis/dummy_data_cache.py analysis/dataset_definition_tables.py \
+#     -- --output output/population/pf_tables.csv.gz
+#   python analysis/dummy_data_cache.py analysis/measures_definition_pf_med_counts.py \
+#     -- --output output/measures/pf_medications_measures.csv
+
+CACHE_DIR = Path("output/dummy_data_cache")
+EHRQL_IMAGE = "ehrql:v1"
+MEASURES_TABLES_DEFINITION = Path(
+    "analysis/dataset_definition_measures_dummy_tables.py"
+)
+
+
+def get_structural_hash(*definitions):
+    digest = hashlib.sha256()
+    paths = set()
+    for definition in definitions:
+        paths.update(get_source_files(definition))
+    for path in sorted(paths):
+        if path.suffix == ".py":
+            content = ast.dump(ast.parse(path.read_text(), filename=str(path)))
+            digest.update(f"{path.as_posix()}:{content}".encode())
+        else:
+            digest.update(path.as_posix().encode() + b":" + path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def get_definition_type(definition):
+    # "dataset" or "measures", from the create_* call in the definition
+    tree = ast.parse(Path(definition).read_text())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            name = getattr(node.func, "id", getattr(node.func, "attr", None))
+            if name == "create_dataset":
+                return "dataset"
+            if name == "create_measures":
+                return "measures"
+    raise ValueError(f"{definition} is neither a dataset nor a measures definition")
+
+
+def get_population_size(definition):
+    # population_size passed to configure_dummy_data, or None if not configured
+    tree = ast.parse(Path(definition).read_text())
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "configure_dummy_data"
+        ):
+            for keyword in node.keywords:
+                if keyword.arg == "population_size":
+                    return ast.literal_eval(keyword.value)
+    return None
+
+
+def get_tables_definition(definition):
+    # The dataset definition create-dummy-tables loads for definition
+    if get_definition_type(definition) == "measures":
+        return MEASURES_TABLES_DEFINITION
+    return Path(definition)
+
+
+def get_cache_path(definition, cache_dir=CACHE_DIR):
+    definition = Path(definition)
+    population_size = get_population_size(definition) or "default"
+    structural_hash = get_structural_hash(definition, get_tables_definition(definition))
+    return cache_dir / definition.stem / f"{population_size}-{structural_hash}"
+
+
+def get_dummy_tables(definition, cache_dir=CACHE_DIR):
+    """
+    Path to cached dummy tables for a dataset or measures definition,
+    generating them if needed
+    """
+    cache_path = get_cache_path(definition, cache_dir)
+    if cache_path.exists():
+        return cache_path, True
+
+    # Tables for an earlier version of the definition are no longer valid
+    for stale_path in cache_path.parent.glob("*"):
+        if stale_path.is_dir():
+            shutil.rmtree(stale_path)
+
+    partial_path = cache_path.with_name(cache_path.name + ".partial")
+    tables_definition = get_tables_definition(definition)
+    population_args = []
+    if tables_definition != Path(definition):
+        population_size = get_population_size(definition)
+        if population_size is not None:
+            population_args = ["--", "--population-size", str(population_size)]
+    subprocess.run(
+        [
+            "opensafely",
+            "exec",
+            EHRQL_IMAGE,
+            "create-dummy-tables",
+            tables_definition.as_posix(),
+            partial_path.as_posix(),
+            *population_args,
+        ],
+        check=True,
+    )
+    partial_path.rename(cache_path)
+    return cache_path, False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument(
+        "ehrql_args",
+        nargs=argparse.REMAINDER,
+        help="Arguments for generate-dataset or generate-measures, after --",
+    )
+    args = parser.parse_args()
+
+    dummy_tables, cached = get_dummy_tables(args.definition)
+    print(f"{'Using cached' if cached else 'Generated'} dummy tables in {dummy_tables}")
+
+    ehrql_args = (
+        args.ehrql_args[1:] if args.ehrql_args[:1] == ["--"] else args.ehrql_args
+    )
+    if ehrql_args:
+        subprocess.run(
+            [
+                "opensafely",
+                "exec",
+                EHRQL_IMAGE,
+                f"generate-{get_definition_type(args.definition)}",
+                args.definition,
+                "--dummy-tables",
+                dummy_tables.as_posix(),
+                *ehrql_args,
+            ],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pandas as pd
+
+from codelist_arrays import encode_codes
+
+# Partitions the event tables written by dataset_definition_extract.py by month,
+# with integer-encoded codes, so local stages only read the months they need.
+# Run with: python analysis/extract_events.py
+
+EXTRACT_DIR = Path("output/extract/tables")
+PARTITION_DIR = Path("output/extract/partitioned")
+
+# Code column of each extracted event table
+EXTRACT_TABLES = {
+    "clinical_events": "snomedct_code",
+    "medications": "dmd_code",
+}
+
+# Partition for events without a date (e.g. old ethnicity codes)
+UNDATED_PARTITION = "undated"
+
+
+def decode_codes(codes):
+    return codes.astype("string")
+
+
+def write_partitions(table, extract_dir=EXTRACT_DIR, partition_dir=PARTITION_DIR):
+    code_column = EXTRACT_TABLES[table]
+    events = pd.read_feather(extract_dir / f"{table}.arrow")
+    # Codes that are not digit strings are stored as missing
+    codes, valid = encode_codes(events[code_column])
+    events[code_column] = pd.Series(codes, index=events.index, dtype="Int64").where(
+        valid
+    )
+    events["date"] = pd.to_datetime(events["date"])
+    events = events.sort_values(["date", "patient_id"], kind="stable")
+
+    table_dir = partition_dir / table
+    table_dir.mkdir(parents=True, exist_ok=True)
+    for old_partition in table_dir.glob("*.parquet"):
+        old_partition.unlink()
+
+    months = events["date"].dt.to_period("M")
+    for month, month_events in events.groupby(months, sort=True):
+        month_events.to_parquet(table_dir / f"{month}.parquet", index=False)
+
+    undated_events = events[events["date"].isna()]
+    if not undated_events.empty:
+        undated_events.to_parquet(
+            table_dir / f"{UNDATED_PARTITION}.parquet", index=False
+        )
+
+
+def read_extract(
+    table,
+    start_date=None,
+    end_date=None,
+    columns=None,
+    decode=False,
+    partition_dir=PARTITION_DIR,
+):
+    """
+    Read the partitioned extract of table, optionally restricted to events
+    between start_date and end_date (inclusive). Only partitions that overlap
+    the date range are read. Undated events are only returned when no start_date
+    is given.
+    """
+    code_column = EXTRACT_TABLES[table]
+    table_dir = partition_dir / table
+    start = pd.Period(start_date, "M") if start_date is not None else None
+    end = pd.Period(end_date, "M") if end_date is not None else None
+
+    paths = []
+    for path in sorted(table_dir.glob("*.parquet")):
+        if path.stem == UNDATED_PARTITION:
+            if start is None:
+                paths.append(path)
+            continue
+        month = pd.Period(path.stem, "M")
+        if (start is None or month >= start) and (end is None or month <= end):
+            paths.append(path)
+
+    if columns is not None and "date" not in columns:
+        read_columns = list(columns) + ["date"]
+    else:
+        read_columns = columns
+
+    if paths:
+        events = pd.concat(
+            [pd.read_parquet(path, columns=read_columns) for path in paths],
+            ignore_index=True,
+        )
+    else:
+        events = pd.DataFrame(
+            columns=read_columns
+            or ["patient_id", "consultation_id", "date", code_column]
+        )
+
+    if start_date is not None:
+        events = events[events["date"] >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        events = events[events["date"] <= pd.Timestamp(end_date)]
+    if columns is not None:
+        events = events[list(columns)]
+    if decode and code_column in events.columns:
+        events = events.assign(**{code_column: decode_codes(events[code_column])})
+
+    return events.reset_index(drop=True)
+
+
+def main():
+    for table in EXTRACT_TABLES:
+        write_partitions(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+from datetime import date, timedelta
+from itertools import product
+
+from config import start_date_dataset_tables, index_date_dataset_tables
+import codelists
+
+# Test data for ehrQL's assure, generated from grids of parameters rather than
+# written by hand. Each grid point is one patient, and the expected values come
+# from the reference functions below, which restate the rules from the NHS
+# England specifications directly on the fixture records rather than reusing
+# the ehrQL code under test. Used by test_dataset_definition_tables_generated.py
+# and test_pf_numerators.py.
+
+launch_date = date.fromisoformat(start_date_dataset_tables)
+index_date = date.fromisoformat(index_date_dataset_tables)
+
+PF_SERVICE_CODE = codelists.pf_consultation_events_dict[
+    "pf_consultation_services_combined"
+][0]
+PREGNANCY_CODE = list(codelists.pregnancy_codelist)[0]
+OTHER_CODE = "1111111"
+
+# dataset_definition_tables.py column -> condition code
+CONDITION_NUMERATORS = {
+    "uti_numerator": codelists.uti_code[0],
+    "sinusitis_numerator": codelists.sinusitis_code[0],
+    "insectbite_numerator": codelists.insectbite_code[0],
+    "otitismedia_numerator": codelists.otitismedia_code[0],
+    "sorethroat_numerator": codelists.sorethroat_code[0],
+    "shingles_numerator": codelists.shingles_code[0],
+    "impetigo_numerator": codelists.impetigo_code[0],
+}
+
+# get_numerator clinical pathway -> eligibility rules of the Pharmacy First
+# clinical pathways. recurrence is (months, count at which the patient is
+# excluded) for the pathway's own code, pregnancy who is excluded if pregnant
+# in the month before the index date.
+PATHWAY_RULES = {
+    "uti": {
+        "code": codelists.uti_code[0],
+        "ages": (16, 64),
+        "sexes": ["female"],
+        "recurrence": [(6, 2), (12, 3)],
+        "pregnancy": "all",
+    },
+    "shingles": {
+        "code": codelists.shingles_code[0],
+        "ages": (18, None),
+        "pregnancy": "all",
+    },
+    "impetigo": {
+        "code": codelists.impetigo_code[0],
+        "ages": (1, None),
+        "recurrence": [(12, 2)],
+        "pregnancy": "under_16",
+    },
+    "insect_bites": {
+        "code": codelists.insectbite_code[0],
+        "ages": (1, None),
+        "pregnancy": "under_16",
+    },
+    "sore_throat": {
+        "code": codelists.sorethroat_code[0],
+        "ages": (5, None),
+        "pregnancy": "under_16",
+    },
+    "sinusitis": {
+        "code": codelists.sinusitis_code[0],
+        "ages": (12, None),
+        "pregnancy": "under_16",
+    },
+    "otitis_media": {
+        "code": codelists.otitismedia_code[0],
+        "ages": (1, 17),
+        "recurrence": [(6, 3), (12, 4)],
+        "pregnancy": "under_16",
+    },
+}
+
+AGE_BANDS = [(0, "0-19"), (20, "20-39"), (40, "40-59"), (60, "60-79"), (80, "80+")]
+
+
+def months_before(day, num_months):
+    # The same day num_months earlier, or the first of the following month
+    # where that day does not exist
+    month = day.month - 1 - num_months
+    year, month = day.year + month // 12, month % 12 + 1
+    try:
+        return date(year, month, day.day)
+    except ValueError:
+        return date(year + month // 12, month % 12 + 1, 1)
+
+
+def born_years_before(day, years, days_after=0):
+    # A date of birth that makes a patient years old on day, or one year
+    # younger when days_after > 0
+    try:
+        born = date(day.year - years, day.month, day.day)
+    except ValueError:
+        born = date(day.year - years, 3, 1)
+    return born + timedelta(days=days_after)
+
+
+def get_age(date_of_birth, day):
+    birthday_passed = (day.month, day.day) >= (date_of_birth.month, date_of_birth.day)
+    return day.year - date_of_birth.year - (0 if birthday_passed else 1)
+
+
+# Reference implementations
+
+
+def reference_tables_columns(patient):
+    """
+    Expected dataset_definition_tables.py columns, or None for a patient
+    outside the population
+    """
+    registered = any(
+        registration["start_date"] <= index_date
+        and (
+            registration.get("end_date") is None
+            or registration["end_date"] >= index_date
+        )
+        for registration in patient["practice_registrations"]
+    )
+    sex = patient["patients"]["sex"]
+    if not registered or sex not in ["male", "female"]:
+        return None
+
+    age = get_age(patient["patients"]["date_of_birth"], index_date)
+    in_period = [
+        event
+        for event in patient["clinical_events"]
+        if launch_date <= event["date"] <= index_date
+    ]
+    pf_ids = {
+        event["consultation_id"]
+        for event in in_period
+        if event["snomedct_code"] == PF_SERVICE_CODE
+    }
+    columns = {
+        "has_pf_consultation": bool(pf_ids),
+        "sex": sex,
+        "age": age,
+        "age_band": [band for lower, band in AGE_BANDS if age >= lower][-1],
+        "imd": "Missing",
+        "ethnicity": "Missing",
+    }
+    for column, code in CONDITION_NUMERATORS.items():
+        columns[column] = any(
+            event["snomedct_code"] == code and event["consultation_id"] in pf_ids
+            for event in in_period
+        )
+    return columns
+
+
+def reference_numerator(patient, clinical_pathway):
+    """Expected get_numerator value for the pathway at index_date"""
+    rules = PATHWAY_RULES[clinical_pathway]
+    events = [
+        event for event in patient["clinical_events"] if event["date"] <= index_date
+    ]
+    age = get_age(patient["patients"]["date_of_birth"], index_date)
+    min_age, max_age = rules["ages"]
+    eligible = age >= min_age and (max_age is None or age <= max_age)
+    if "sexes" in rules:
+        eligible = eligible and patient["patients"]["sex"] in rules["sexes"]
+
+    for num_months, excluded_from in rules.get("recurrence", []):
+        start_date = months_before(index_date, num_months)
+        count = sum(
+            event["snomedct_code"] == rules["code"] and event["date"] >= start_date
+            for event in events
+        )
+        eligible = eligible and count < excluded_from
+
+    pregnant = any(
+        event["snomedct_code"] == PREGNANCY_CODE
+        and event["date"] >= months_before(index_date, 1)
+        for event in events
+    )
+    if rules["pregnancy"] == "all" or age < 16:
+        eligible = eligible and not pregnant
+
+    return eligible and any(event["snomedct_code"] == rules["code"] for event in events)
+
+
+# Grids
+
+
+def tables_patients():
+    """
+    Patients for every combination of sex, age either side of the age band
+    boundaries, registration end, condition, consultation linkage and timing
+    """
+    ages = [0, 19, 20, 39, 40, 59, 60, 79, 80]
+    registration_ends = [None, index_date - timedelta(days=1), index_date]
+    linkages = ["same_consultation", "other_consultation", "no_pf_consultation"]
+    timings = ["in_period", "pf_before_launch", "condition_before_launch"]
+    grid = product(
+        ["female", "male", "unknown"],
+        ages,
+        [0, 1],
+        registration_ends,
+        CONDITION_NUMERATORS.values(),
+        linkages,
+        timings,
+    )
+    for sex, age, days_after, registration_end, code, linkage, timing in grid:
+        if age == 0 and days_after:
+            # Born after the index date
+            continue
+        before_launch = launch_date - timedelta(days=1)
+        pf_date = before_launch if timing == "pf_before_launch" else launch_date
+        condition_date = (
+            before_launch if timing == "condition_before_launch" else index_date
+        )
+        clinical_events = [
+            {
+                "consultation_id": 2 if linkage == "other_consultation" else 1,
+                "date": condition_date,
+                "snomedct_code": code,
+            },
+        ]
+        if linkage != "no_pf_consultation":
+            clinical_events.append(
+                {
+                    "consultation_id": 1,
+                    "date": pf_date,
+                    "snomedct_code": PF_SERVICE_CODE,
+                }
+            )
+        yield {
+            "patients": {
+                "date_of_birth": born_years_before(index_date, age, days_after),
+                "sex": sex,
+            },
+            "clinical_events": clinical_events,
+            "practice_registrations": [
+                {"start_date": date(2020, 1, 1), "end_date": registration_end}
+            ],
+        }
+
+
+def numerator_patients():
+    """
+    Patients for every combination of clinical pathway, age either side of
+    the pathway limits, sex, pregnancy timing and past recurrences of the
+    pathway's condition in the last 6 and 6 to 12 months
+    """
+    ages = [0, 1, 4, 5, 11, 12, 15, 16, 17, 18, 64, 65]
+    one_month_before = months_before(index_date, 1)
+    pregnancy_dates = [
+        None,
+        one_month_before - timedelta(days=1),
+        one_month_before,
+        index_date,
+        index_date + timedelta(days=1),
+    ]
+    recurrences = [0, 1, 2, 3]
+    grid = product(
+        PATHWAY_RULES.items(),
+        ages,
+        ["female", "male"],
+        pregnancy_dates,
+        recurrences,
+        recurrences,
+    )
+    for (_, rules), age, sex, pregnancy_date, recent, earlier in grid:
+        code = rules["code"]
+        # The current episode, and earlier episodes on the first day of the 6
+        # and 12 month windows, and just before the 12 month window
+        clinical_events = [{"date": index_date, "snomedct_code": code}]
+        clinical_events += [
+            {"date": months_before(index_date, 6), "snomedct_code": code}
+        ] * recent
+        clinical_events += [
+            {"date": months_before(index_date, 12), "snomedct_code": code}
+        ] * earlier
+        clinical_events += [
+            {
+                "date": months_before(index_date, 12) - timedelta(days=1),
+                "snomedct_code": code,
+            },
+            {"date": index_date, "snomedct_code": OTHER_CODE},
+        ]
+        if pregnancy_date is not None:
+            clinical_events.append(
+                {"date": pregnancy_date, "snomedct_code": PREGNANCY_CODE}
+            )
+        yield {
+            "patients": {
+                "date_of_birth": born_years_before(index_date, age),
+                "sex": sex,
+            },
+            "clinical_events": clinical_events,
+        }
+
+
+# Test data
+
+
+def tables_test_data(first_patient_id=1):
+    test_data = {}
+    for patient_id, patient in enumerate(tables_patients(), start=first_patient_id):
+        expected_columns = reference_tables_columns(patient)
+        test_data[patient_id] = {
+            **patient,
+            "expected_in_population": expected_columns is not None,
+        }
+        if expected_columns is not None:
+            test_data[patient_id]["expected_columns"] = expected_columns
+    return test_data
+
+
+def numerator_test_data():
+    test_data = {}
+    for patient_id, patient in enumerate(numerator_patients(), start=1):
+        test_data[patient_id] = {
+            **patient,
+            "expected_in_population": True,
+            "expected_columns": {
+                f"{clinical_pathway}_numerator": reference_numerator(
+                    patient, clinical_pathway
+                )
+                for clinical_pathway in PATHWAY_RULES
+            },
+        }
+    return test_data
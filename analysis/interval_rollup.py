@@ -0,0 +1,157 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from local_engine import (
+    AsOfIndexes,
+    Measures,
+    SparseIntervalGrid,
+    get_intervals,
+    get_registered_population,
+    in_intervals,
+)
+from pf_consultations import (
+    DATASET_DIR,
+    PF_SERVICES_COMBINED,
+    count_events,
+    get_count_columns,
+    get_pf_conditions,
+    load_dataset,
+)
+
+# Pharmacy First consultation counts at several resolutions from one
+# extraction (dataset_definition_pf_consultations.py). Events are counted once
+# per patient and day; the counts for each resolution are sums of those daily
+# counts, and a patient is in an interval's denominator if they had a Pharmacy
+# First consultation on any day in it. Every resolution is rolled up from the
+# daily counts, as weeks do not nest in months. Only the (patient, interval)
+# pairs with a consultation are counted, and registration is resolved for
+# those alone. Weeks are ISO weeks (Monday to Sunday) and quarters are
+# calendar quarters. The monthly output matches the count_* total measures of
+# measures_definition_pf_breakdown.py.
+#
+# Run with:
+#   python analysis/interval_rollup.py --resolution weekly --resolution monthly
+
+OUTPUT_DIR = Path("output/pf_consultations/rollup")
+RESOLUTIONS = ["daily", "weekly", "monthly", "quarterly"]
+
+
+def get_rollup_intervals(resolution, start_date, monthly_intervals):
+    """
+    Intervals of the given resolution from start_date to the end of
+    monthly_intervals months, as months(n).starting_on(start_date) would give
+    for monthly. Weeks are ISO weeks and quarters calendar quarters; those not
+    wholly within the period are left out.
+    """
+    months = get_intervals(start_date, monthly_intervals)
+    end_date = months["interval_end"].iloc[-1]
+    if resolution == "daily":
+        starts = pd.date_range(start_date, end_date, freq="D")
+        ends = starts
+    elif resolution == "weekly":
+        starts = pd.date_range(start_date, end_date, freq="W-MON")
+        ends = starts + pd.Timedelta(days=6)
+    elif resolution == "monthly":
+        return months
+    elif resolution == "quarterly":
+        starts = pd.date_range(start_date, end_date, freq="QS")
+        ends = starts + pd.offsets.QuarterEnd()
+    else:
+        raise ValueError(
+            f"Unknown resolution {resolution}, expected one of {RESOLUTIONS}"
+        )
+    intervals = pd.DataFrame({"interval_start": starts, "interval_end": ends})
+    return intervals[intervals["interval_end"] <= end_date].reset_index(drop=True)
+
+
+def get_daily_counts(dataset, start_date, end_date, pf_conditions=None):
+    """
+    One row per patient and day with Pharmacy First linked events, with the
+    number of events counted towards each service and condition measure
+    """
+    pf_conditions = pf_conditions or get_pf_conditions()
+    events = dataset["consultation_events"]
+    # As the breakdown measures, only events with a consultation_id are linked
+    events = events[
+        events["consultation_id"].notna()
+        & (events["date"] >= pd.Timestamp(start_date))
+        & (events["date"] <= pd.Timestamp(end_date))
+    ]
+    counts = count_events(events, pf_conditions)
+    del counts["n_other_events"]
+    return (
+        events[["patient_id", "date"]]
+        .assign(**counts)
+        .groupby(["patient_id", "date"], sort=True)
+        .sum()
+        .astype(np.int32)
+        .reset_index()
+    )
+
+
+def rollup_measures(daily_counts, dataset, intervals, pf_conditions=None):
+    # count_<service or condition> measures for intervals, from the daily counts
+    pf_conditions = pf_conditions or get_pf_conditions()
+    daily_counts = in_intervals(daily_counts, intervals)
+    grid = SparseIntervalGrid(daily_counts, intervals)
+    rows = grid.rows(daily_counts)
+    measures = Measures(grid)
+
+    def sum_for_patient(column):
+        return np.bincount(
+            rows, weights=daily_counts[column].to_numpy(), minlength=len(grid)
+        ).astype(np.int64)
+
+    _, registered = get_registered_population(grid, dataset, AsOfIndexes(dataset))
+    has_pf_consultation = sum_for_patient(f"n_{PF_SERVICES_COMBINED}") > 0
+    denominator = registered & has_pf_consultation
+    for name, column in get_count_columns(pf_conditions).items():
+        measures.define_measure(
+            name=f"count_{name}",
+            numerator=sum_for_patient(column),
+            denominator=denominator,
+        )
+    return measures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resolution",
+        action="append",
+        choices=RESOLUTIONS,
+        help="Can be repeated; defaults to all resolutions",
+    )
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    start_date = config.start_date_pf_consultations
+    monthly_intervals = config.monthly_intervals_pf_consultations
+    daily_intervals = get_rollup_intervals("daily", start_date, monthly_intervals)
+    pf_conditions = get_pf_conditions()
+    dataset = load_dataset(args.dataset)
+    daily_counts = get_daily_counts(
+        dataset,
+        start_date,
+        daily_intervals["interval_end"].iloc[-1],
+        pf_conditions,
+    )
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    daily_counts.to_parquet(output_dir / "daily_counts.parquet", index=False)
+    for resolution in args.resolution or RESOLUTIONS:
+        intervals = get_rollup_intervals(resolution, start_date, monthly_intervals)
+        measures = rollup_measures(daily_counts, dataset, intervals, pf_conditions)
+        measures.results().to_csv(
+            output_dir / f"pf_counts_{resolution}.csv", index=False
+        )
+
+
+if __name__ == "__main__":
+    main()
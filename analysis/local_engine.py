@@ -0,0 +1,580 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from asof_index import AsOfIndex
+from codelist_arrays import CodeArray
+from disclosure_control import round_counts
+from extract_events import EXTRACT_TABLES, read_extract
+from measure_shards import add_months
+
+# Vectorised pandas/NumPy versions of the ehrQL operations used by the
+# definitions in this project, evaluated for every monthly interval at once.
+# See local_measures.py for the definitions written against these.
+
+# Table name -> (dummy table file name, columns)
+TABLES = {
+    "patients": ("patients.csv", ["patient_id", "date_of_birth", "sex"]),
+    "clinical_events": (
+        "clinical_events.csv",
+        ["patient_id", "consultation_id", "date", "snomedct_code"],
+    ),
+    "medications": (
+        "medications_raw.csv",
+        ["patient_id", "consultation_id", "date", "dmd_code"],
+    ),
+    "practice_registrations": (
+        "practice_registrations.csv",
+        [
+            "patient_id",
+            "start_date",
+            "end_date",
+            "practice_pseudo_id",
+            "practice_nuts1_region_name",
+        ],
+    ),
+    "addresses": (
+        "addresses.csv",
+        ["patient_id", "start_date", "end_date", "has_postcode", "imd_rounded"],
+    ),
+    "ethnicity_from_sus": ("ethnicity_from_sus.csv", ["patient_id", "code"]),
+}
+
+DATE_COLUMNS = ["date", "date_of_birth", "start_date", "end_date"]
+INTEGER_COLUMNS = ["consultation_id", "imd_rounded", "practice_pseudo_id"]
+BOOLEAN_COLUMNS = ["has_postcode"]
+
+# Table name -> column whose true rows for_patient_on prefers
+PREFER_COLUMNS = {"addresses": "has_postcode"}
+
+# Booleans as ehrQL writes them in measures output and dummy tables
+BOOLEAN_VALUES = {True: "T", False: "F"}
+
+MEASURES_COLUMNS = [
+    "measure",
+    "interval_start",
+    "interval_end",
+    "ratio",
+    "numerator",
+    "denominator",
+]
+
+
+def load_tables(path="dummy_tables", extract_dir=None):
+    # Tables without a file (e.g. addresses in dummy_tables) are empty. With
+    # extract_dir, clinical_events and medications are read from the partitioned
+    # extract written by extract_events.py instead of path.
+    path = Path(path)
+    tables = {}
+    for name, (file_name, columns) in TABLES.items():
+        if extract_dir is not None and name in EXTRACT_TABLES:
+            table = read_extract(
+                name, columns=columns, decode=True, partition_dir=Path(extract_dir)
+            )
+        elif (path / file_name).exists():
+            table = pd.read_csv(path / file_name, dtype=str)
+        else:
+            table = pd.DataFrame(columns=columns, dtype=object)
+        for column in columns:
+            if column not in table.columns:
+                table[column] = None
+        table["patient_id"] = table["patient_id"].astype("int64")
+        for column in table.columns:
+            if column in DATE_COLUMNS:
+                table[column] = pd.to_datetime(table[column])
+            elif column in INTEGER_COLUMNS:
+                table[column] = pd.to_numeric(table[column]).astype("Int64")
+            elif column in BOOLEAN_COLUMNS:
+                table[column] = table[column].map(
+                    {value: key for key, value in BOOLEAN_VALUES.items()}
+                )
+        tables[name] = table
+    return tables
+
+
+def get_intervals(start_date, monthly_intervals):
+    # months(monthly_intervals).starting_on(start_date)
+    starts = pd.DatetimeIndex(
+        [add_months(start_date, month) for month in range(monthly_intervals + 1)]
+    )
+    return pd.DataFrame(
+        {
+            "interval_start": starts[:-1],
+            "interval_end": starts[1:] - pd.Timedelta(days=1),
+        }
+    )
+
+
+def is_in(values, codelist):
+    return CodeArray.from_codelist(codelist).isin(values)
+
+
+def is_on_or_between(dates, start_date, end_date):
+    dates = pd.to_datetime(dates)
+    return ((dates >= start_date) & (dates <= end_date)).to_numpy(bool)
+
+
+def in_intervals(events, intervals, date_column="date"):
+    """
+    events.where(events.date.is_on_or_between(INTERVAL.start_date, INTERVAL.end_date))
+    for every interval at once. Adds an interval column (position in intervals);
+    intervals must not overlap, so each event is in at most one.
+    """
+    starts = intervals["interval_start"].to_numpy("datetime64[ns]")
+    ends = intervals["interval_end"].to_numpy("datetime64[ns]")
+    dates = events[date_column].to_numpy("datetime64[ns]")
+    positions = np.searchsorted(starts, dates, side="right") - 1
+    clipped = positions.clip(0, len(intervals) - 1)
+    keep = (positions >= 0) & (dates <= ends[clipped]) & ~np.isnat(dates)
+    return events[keep].assign(interval=positions[keep])
+
+
+def _match_keys(events, other_events):
+    # Interval-restricted frames are only compared within the same interval,
+    # as ehrQL does when both sides use INTERVAL
+    if "interval" in events.columns and "interval" in other_events.columns:
+        return ["patient_id", "interval"]
+    return ["patient_id"]
+
+
+def is_in_for_patient(events, column, other_events, other_column):
+    """
+    events.column.is_in(other_events.other_column): whether each event's value
+    is among the same patient's values in other_events. Missing values never match.
+    """
+    keys = _match_keys(events, other_events)
+    other = (
+        other_events[keys + [other_column]]
+        .dropna()
+        .drop_duplicates()
+        .rename(columns={other_column: "_value"})
+        .assign(_match=True)
+    )
+    matched = (
+        events[keys + [column]]
+        .rename(columns={column: "_value"})
+        .merge(other, how="left", on=keys + ["_value"])["_match"]
+    )
+    return matched.notna().to_numpy(bool)
+
+
+def is_not_in_for_patient(events, column, other_events, other_column):
+    # Missing values are neither in nor not in, as in ehrQL
+    return ~is_in_for_patient(events, column, other_events, other_column) & events[
+        column
+    ].notna().to_numpy(bool)
+
+
+def case(conditions, otherwise=None):
+    """
+    case(when(condition).then(value), ..., otherwise=otherwise), with conditions
+    a list of (condition array, value) pairs evaluated in order
+    """
+    choices = [
+        np.broadcast_to(np.asarray(value, dtype=object), np.shape(condition))
+        for condition, value in conditions
+    ]
+    return np.select(
+        [np.asarray(condition, dtype=bool) for condition, _ in conditions],
+        choices,
+        default=otherwise,
+    )
+
+
+def age_on(date_of_birth, dates):
+    date_of_birth = pd.DatetimeIndex(date_of_birth)
+    dates = pd.DatetimeIndex(dates)
+    before_birthday = (dates.month < date_of_birth.month) | (
+        (dates.month == date_of_birth.month) & (dates.day < date_of_birth.day)
+    )
+    age = dates.year - date_of_birth.year - before_birthday.astype(int)
+    return pd.array(np.where(date_of_birth.isna(), None, age), dtype="Int64")
+
+
+class IntervalGrid:
+    """
+    One row per patient and interval. Patient-level values for all intervals
+    are arrays aligned with the rows of frame.
+    """
+
+    def __init__(self, patient_ids, intervals):
+        self.patient_ids = np.unique(np.asarray(patient_ids, dtype=np.int64))
+        self.intervals = intervals.reset_index(drop=True)
+        num_intervals = len(self.intervals)
+        interval = np.tile(np.arange(num_intervals), len(self.patient_ids))
+        self.frame = pd.DataFrame(
+            {
+                "patient_id": np.repeat(self.patient_ids, num_intervals),
+                "interval": interval,
+                "interval_start": self.intervals["interval_start"].to_numpy()[interval],
+                "interval_end": self.intervals["interval_end"].to_numpy()[interval],
+            }
+        )
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, events):
+        """
+        Grid row of each event, or -1 for patients not in the grid. Events
+        without an interval column must be reduced per interval first.
+        """
+        patient_ids = events["patient_id"].to_numpy(np.int64)
+        positions = np.searchsorted(self.patient_ids, patient_ids)
+        known = positions < len(self.patient_ids)
+        known[known] = self.patient_ids[positions[known]] == patient_ids[known]
+        rows = positions * len(self.intervals) + events["interval"].to_numpy(np.int64)
+        return np.where(known, rows, -1)
+
+    def _bincount(self, rows):
+        return np.bincount(rows[rows >= 0], minlength=len(self))
+
+    def exists_for_patient(self, events):
+        return self._bincount(self.rows(events)) > 0
+
+    def count_for_patient(self, events):
+        return self._bincount(self.rows(events))
+
+    def count_distinct_for_patient(self, events, column):
+        values = events[column]
+        distinct = pd.DataFrame({"row": self.rows(events), "value": values.to_numpy()})[
+            values.notna().to_numpy(bool)
+        ].drop_duplicates()
+        return self._bincount(distinct["row"].to_numpy(np.int64))
+
+    def first_for_patient(self, events, sort_column, column, last=False):
+        """
+        events.sort_by(sort_column).first_for_patient().column (or
+        last_for_patient with last=True); None where a patient has no events
+        """
+        ordered = pd.DataFrame(
+            {
+                "row": self.rows(events),
+                "sort": events[sort_column].to_numpy(),
+                "value": events[column].to_numpy(dtype=object),
+            }
+        )
+        ordered = ordered[ordered["row"] >= 0].sort_values(
+            ["row", "sort"], kind="stable"
+        )
+        picked = ordered.drop_duplicates("row", keep="last" if last else "first")
+        result = np.full(len(self), None, dtype=object)
+        result[picked["row"].to_numpy(np.int64)] = picked["value"].to_numpy()
+        return result
+
+    def patient_column(self, table, column):
+        # Value of a one-row-per-patient table column for every grid row
+        values = table.drop_duplicates("patient_id").set_index("patient_id")[column]
+        return values.reindex(self.frame["patient_id"]).to_numpy(dtype=object)
+
+    def for_patient_on(self, table, date_column):
+        """
+        table.for_patient_on(date) for the date in date_column of each grid row
+        (e.g. "interval_end"): rows with start_date on or before the date and no
+        end_date before it. Where several match, the most recent start is used,
+        then the latest end (a missing end_date counts as latest). table is a
+        table or its AsOfIndex.from_spans. Returns the table's columns aligned
+        with the grid, and an exists column.
+        """
+        if not isinstance(table, AsOfIndex):
+            table = AsOfIndex.from_spans(table)
+        return table.on(self.frame["patient_id"], self.frame[date_column])
+
+    def latest_on_or_before(self, events, date_column, column):
+        """
+        events.where(events.date.is_on_or_before(date)).sort_by(events.date)
+        .last_for_patient().column, for the date in date_column of each grid row.
+        events is an events table or its AsOfIndex.from_events for column.
+        """
+        if not isinstance(events, AsOfIndex):
+            events = AsOfIndex.from_events(events, column)
+        values = events.on(self.frame["patient_id"], self.frame[date_column])[column]
+        return np.where(values.notna(), values.to_numpy(dtype=object), None)
+
+
+class SparseIntervalGrid(IntervalGrid):
+    """
+    IntervalGrid with only the (patient, interval) rows of events, for
+    measures whose denominator needs an event in the interval, so the other
+    rows of the full grid could never count. events must have an interval
+    column (see in_intervals).
+    """
+
+    def __init__(self, events, intervals):
+        pairs = (
+            pd.DataFrame(
+                {
+                    "patient_id": events["patient_id"].to_numpy(np.int64),
+                    "interval": events["interval"].to_numpy(np.int64),
+                }
+            )
+            .drop_duplicates()
+            .sort_values(["patient_id", "interval"], ignore_index=True)
+        )
+        self.patient_ids = pairs["patient_id"].unique()
+        self.intervals = intervals.reset_index(drop=True)
+        interval = pairs["interval"].to_numpy()
+        self.frame = pairs.assign(
+            interval_start=self.intervals["interval_start"].to_numpy()[interval],
+            interval_end=self.intervals["interval_end"].to_numpy()[interval],
+        )
+        self._index = pd.MultiIndex.from_frame(pairs)
+
+    def rows(self, events):
+        return self._index.get_indexer(
+            pd.MultiIndex.from_arrays(
+                [
+                    events["patient_id"].to_numpy(np.int64),
+                    events["interval"].to_numpy(np.int64),
+                ]
+            )
+        )
+
+
+class AsOfIndexes:
+    """
+    AsOfIndex.from_spans of each span table, built on first use and held
+    alongside the tables, so every grid and interval resolves against the same
+    index
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.indexes = {}
+
+    def __getitem__(self, name):
+        if name not in self.indexes:
+            self.indexes[name] = AsOfIndex.from_spans(
+                self.tables[name], prefer_column=PREFER_COLUMNS.get(name)
+            )
+        return self.indexes[name]
+
+
+# Demographics shared by the definitions
+
+
+def get_registered_population(grid, tables, indexes):
+    # practice_registrations.for_patient_on(INTERVAL.end_date).exists_for_patient()
+    # & patients.sex.is_in(["male", "female"])
+    registration = grid.for_patient_on(
+        indexes["practice_registrations"], "interval_end"
+    )
+    sex = grid.patient_column(tables["patients"], "sex")
+    return registration, registration["exists"].to_numpy(bool) & np.isin(
+        sex, ["male", "female"]
+    )
+
+
+def get_age_band(grid, tables, date_column="interval_start"):
+    age = age_on(
+        grid.patient_column(tables["patients"], "date_of_birth"),
+        grid.frame[date_column],
+    )
+    missing = age.isna()
+    age = age.fillna(-1).to_numpy(np.int64)
+    return case(
+        [
+            (~missing & (age >= 0) & (age < 20), "0-19"),
+            (~missing & (age >= 20) & (age < 40), "20-39"),
+            (~missing & (age >= 40) & (age < 60), "40-59"),
+            (~missing & (age >= 60) & (age < 80), "60-79"),
+            (~missing & (age >= 80), "80+"),
+            (missing, "Missing"),
+        ]
+    )
+
+
+def get_imd_quintile(grid, indexes, date_column="interval_start"):
+    imd = grid.for_patient_on(indexes["addresses"], date_column)["imd_rounded"]
+    missing = imd.isna().to_numpy(bool)
+    imd = imd.fillna(-1).to_numpy(np.int64)
+    max_imd = 32844
+    return case(
+        [
+            (~missing & (imd >= 0) & (imd < int(max_imd * 1 / 5)), "1 (Most Deprived)"),
+            (~missing & (imd < int(max_imd * 2 / 5)), "2"),
+            (~missing & (imd < int(max_imd * 3 / 5)), "3"),
+            (~missing & (imd < int(max_imd * 4 / 5)), "4"),
+            (~missing & (imd <= max_imd), "5 (Least Deprived)"),
+        ],
+        otherwise="Missing",
+    )
+
+
+def get_ethnicity_group6(
+    grid, ethnicity_events, ethnicity_from_sus, date_column="interval_start"
+):
+    """
+    pf_dataset.get_latest_ethnicity with grouping=6. ethnicity_events are the
+    events with an ethnicity code, with the code's Grouping_6 category in an
+    ethnicity column.
+    """
+    category = grid.latest_on_or_before(ethnicity_events, date_column, "ethnicity")
+
+    from_codes = case(
+        [
+            (category == "1", "White"),
+            (category == "2", "Mixed"),
+            (category == "3", "Asian or Asian British"),
+            (category == "4", "Black or Black British"),
+            (category == "5", "Chinese or Other Ethnic Groups"),
+        ]
+    )
+    sus_code = grid.patient_column(ethnicity_from_sus, "code")
+    from_sus = case(
+        [
+            (np.isin(sus_code, ["A", "B", "C"]), "White"),
+            (np.isin(sus_code, ["D", "E", "F", "G"]), "Mixed"),
+            (np.isin(sus_code, ["H", "J", "K", "L"]), "Asian or Asian British"),
+            (np.isin(sus_code, ["M", "N", "P"]), "Black or Black British"),
+            (np.isin(sus_code, ["R", "S"]), "Chinese or Other Ethnic Groups"),
+        ]
+    )
+    return case(
+        [
+            (pd.notna(from_codes), from_codes),
+            (pd.notna(from_sus), from_sus),
+        ],
+        otherwise="Missing",
+    )
+
+
+def to_output_values(values):
+    """
+    Group values as ehrQL writes them: booleans as T/F, missing values as
+    empty and anything else as a string. values are all of one type, as a
+    group_by variable is.
+    """
+    values = pd.Series(np.asarray(values, dtype=object))
+    missing = values.isna().to_numpy()
+    if pd.api.types.infer_dtype(values, skipna=True) == "boolean":
+        output = np.where(
+            values.where(~missing, False).astype(bool),
+            BOOLEAN_VALUES[True],
+            BOOLEAN_VALUES[False],
+        )
+    else:
+        output = values.astype(str).to_numpy()
+    return np.where(missing, "", output).astype(object)
+
+
+def apply_disclosure_control(results):
+    # As ehrQL's configure_disclosure_control: counts of 7 or fewer are
+    # suppressed and the rest rounded to the nearest 5
+    results = results.copy()
+    for column in ["numerator", "denominator"]:
+        results[column] = round_counts(results[column]).astype(np.int64)
+    results["ratio"] = results["numerator"] / results["denominator"].replace(0, np.nan)
+    return results
+
+
+class Measures:
+    """
+    Local counterpart of ehrQL's create_measures(). Patients are counted for
+    an interval if their denominator is non-zero.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.measures = {}
+        self.disclosure_control = False
+
+    def configure_disclosure_control(self, enabled=True):
+        self.disclosure_control = enabled
+
+    def define_measure(self, name, numerator, denominator, group_by=None):
+        if name in self.measures:
+            raise ValueError(f"Measure {name} is already defined")
+        self.measures[name] = (
+            np.asarray(numerator),
+            np.asarray(denominator),
+            group_by or {},
+        )
+
+    def group_columns(self):
+        columns = []
+        for _, _, group_by in self.measures.values():
+            columns.extend(column for column in group_by if column not in columns)
+        return columns
+
+    def results(self):
+        group_columns = self.group_columns()
+        intervals = self.grid.intervals
+        frames = []
+        # Group-by variables are usually shared by many measures, so each is
+        # converted once (the variable is kept, so its id is not reused)
+        output_values = {}
+        for name, (numerator, denominator, group_by) in self.measures.items():
+            population = denominator.astype(bool)
+            frame = pd.DataFrame(
+                {
+                    "interval": self.grid.frame["interval"].to_numpy()[population],
+                    "numerator": numerator[population].astype(np.int64),
+                    "denominator": denominator[population].astype(np.int64),
+                }
+            )
+            for column, values in group_by.items():
+                if id(values) not in output_values:
+                    output_values[id(values)] = (values, to_output_values(values))
+                frame[column] = output_values[id(values)][1][population]
+            grouped = (
+                frame.groupby(["interval", *group_by], sort=True)[
+                    ["numerator", "denominator"]
+                ]
+                .sum()
+                .reset_index()
+            )
+            grouped.insert(0, "measure", name)
+            frames.append(grouped)
+
+        results = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        for column in group_columns:
+            if column not in results.columns:
+                results[column] = ""
+            results[column] = results[column].fillna("")
+        results["interval_start"] = (
+            intervals["interval_start"]
+            .dt.strftime("%Y-%m-%d")
+            .to_numpy()[results["interval"].to_numpy(np.int64)]
+        )
+        results["interval_end"] = (
+            intervals["interval_end"]
+            .dt.strftime("%Y-%m-%d")
+            .to_numpy()[results["interval"].to_numpy(np.int64)]
+        )
+        results["ratio"] = results["numerator"] / results["denominator"]
+        results = results[MEASURES_COLUMNS + group_columns]
+        if self.disclosure_control:
+            results = apply_disclosure_control(results)
+        return results
+
+
+def compare_measures(local_results, ehrql_path):
+    """
+    Rows where the local numerator or denominator differs from the ehrQL
+    measures output at ehrql_path, including rows only present on one side.
+    """
+    ehrql_results = pd.read_csv(ehrql_path, dtype=str, keep_default_na=False)
+    local_results = local_results.astype({"numerator": str, "denominator": str})
+    key_columns = [
+        column
+        for column in local_results.columns
+        if column not in ["ratio", "numerator", "denominator"]
+    ]
+    for column in key_columns:
+        if column not in ehrql_results.columns:
+            ehrql_results[column] = ""
+    merged = local_results.drop(columns="ratio").merge(
+        ehrql_results[key_columns + ["numerator", "denominator"]],
+        how="outer",
+        on=key_columns,
+        suffixes=("_local", "_ehrql"),
+        indicator=True,
+    )
+    differs = (
+        (merged["_merge"] != "both")
+        | (merged["numerator_local"] != merged["numerator_ehrql"])
+        | (merged["denominator_local"] != merged["denominator_ehrql"])
+    )
+    return merged[differs].drop(columns="_merge").reset_index(drop=True)
@@ -0,0 +1,357 @@
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from codelists import (
+    ethnicity_group6_codelist,
+    pf_conditions_codelist,
+    pf_consultation_events_dict,
+    pf_med_codelist,
+)
+from codelist_arrays import CodeArray
+import config
+from local_engine import (
+    AsOfIndexes,
+    IntervalGrid,
+    Measures,
+    case,
+    compare_measures,
+    get_age_band,
+    get_ethnicity_group6,
+    get_imd_quintile,
+    get_intervals,
+    in_intervals,
+    is_in,
+    is_in_for_patient,
+    is_not_in_for_patient,
+    load_tables,
+)
+from population_cache import PopulationCache
+
+# Fast local evaluation of the measures_definition_pf_*.py files against
+# dummy-tables-style CSVs, evaluating every interval in one vectorised pass.
+# Each function below mirrors one definition file; keep them in step.
+#
+# Run with:
+#   python analysis/local_measures.py pf_med_counts --dummy-tables dummy_tables
+# or, with the events read from the partitioned extract (partition_extract action):
+#   python analysis/local_measures.py pf_med_counts --extract-dir output/extract/partitioned
+# and cross-check against ehrQL output (generated from the same dummy tables) with:
+#   python analysis/local_measures.py pf_med_counts --compare output/measures/pf_medications_measures.csv
+
+pf_services_codes = pf_consultation_events_dict["pf_consultation_services_combined"]
+
+# Measure names of the clinical pathway conditions, as in measures_definition_pf_breakdown.py
+pharmacy_first_conditions_codes = {
+    term.lower().replace(" ", "_"): [code]
+    for code, term in pf_conditions_codelist.items()
+}
+
+
+class EvaluationContext:
+    """
+    The tables the definitions are evaluated against, with their as-of indexes
+    and pf_denominators.py populations, shared by every definition evaluated
+    with the same context
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.indexes = AsOfIndexes(tables)
+        clinical_events = tables["clinical_events"]
+        self.populations = PopulationCache(
+            tables,
+            self.indexes,
+            clinical_events[is_in(clinical_events["snomedct_code"], pf_services_codes)],
+        )
+
+
+def get_latest_ethnicity(grid, tables, date_column="interval_start"):
+    # pf_dataset.get_latest_ethnicity with grouping=6
+    clinical_events = tables["clinical_events"]
+    ethnicity_codes = CodeArray.from_codelist(ethnicity_group6_codelist)
+    ethnicity_events = clinical_events[
+        ethnicity_codes.isin(clinical_events["snomedct_code"])
+    ]
+    ethnicity_events = ethnicity_events.assign(
+        ethnicity=ethnicity_codes.to_category(ethnicity_events["snomedct_code"])
+    )
+    return get_ethnicity_group6(
+        grid, ethnicity_events, tables["ethnicity_from_sus"], date_column
+    )
+
+
+def pf_breakdown(context):
+    tables = context.tables
+    intervals = get_intervals(
+        config.start_date_measure_pf_breakdown,
+        config.monthly_intervals_measure_pf_breakdown,
+    )
+    grid = IntervalGrid(tables["patients"]["patient_id"], intervals)
+    measures = Measures(grid)
+    clinical_events = tables["clinical_events"]
+
+    registration = grid.for_patient_on(
+        context.indexes["practice_registrations"], "interval_end"
+    )
+    registered = context.populations.registered(grid)
+    region = registration["practice_nuts1_region_name"].to_numpy(dtype=object)
+    breakdown_metrics = {
+        "age_band": get_age_band(grid, tables),
+        "sex": grid.patient_column(tables["patients"], "sex"),
+        "imd": get_imd_quintile(grid, context.indexes),
+        "region": case(
+            [(~registration["practice_nuts1_region_name"].isna(), region)],
+            otherwise="Missing",
+        ),
+        "ethnicity": get_latest_ethnicity(grid, tables),
+    }
+
+    pharmacy_first_events = clinical_events[
+        is_in(clinical_events["snomedct_code"], pf_services_codes)
+    ]
+    interval_events = in_intervals(clinical_events, intervals)
+    selected_events = interval_events[
+        is_in_for_patient(
+            interval_events, "consultation_id", pharmacy_first_events, "consultation_id"
+        )
+    ]
+    has_pf_consultation = grid.exists_for_patient(
+        selected_events[is_in(selected_events["snomedct_code"], pf_services_codes)]
+    )
+    denominator = registered & has_pf_consultation
+
+    measure_codes = {**pf_consultation_events_dict, **pharmacy_first_conditions_codes}
+    for measure_name, codelist in measure_codes.items():
+        numerator = grid.count_for_patient(
+            selected_events[is_in(selected_events["snomedct_code"], codelist)]
+        )
+        measures.define_measure(
+            name=f"count_{measure_name}",
+            numerator=numerator,
+            denominator=denominator,
+        )
+        for breakdown, variable in breakdown_metrics.items():
+            measures.define_measure(
+                name=f"count_{measure_name}_by_{breakdown}",
+                numerator=numerator,
+                denominator=denominator,
+                group_by={breakdown: variable},
+            )
+    return measures
+
+
+def pf_condition_provider(context):
+    tables = context.tables
+    intervals = get_intervals(
+        config.start_date_measure_condition_provider,
+        config.monthly_intervals_measure_condition_provider,
+    )
+    grid = IntervalGrid(tables["patients"]["patient_id"], intervals)
+    measures = Measures(grid)
+
+    populations = context.populations
+    denominator = populations.registered(grid)
+    imd_quintile = get_imd_quintile(grid, context.indexes)
+    selected_events = in_intervals(tables["clinical_events"], intervals)
+    # Only read within the registered denominator
+    has_pharmacy_first = populations.pf_consulting(grid)
+
+    for condition_name, condition_code in pharmacy_first_conditions_codes.items():
+        numerator = grid.count_for_patient(
+            selected_events[is_in(selected_events["snomedct_code"], condition_code)]
+        )
+        measures.define_measure(
+            name=f"count_{condition_name}_total",
+            numerator=numerator,
+            denominator=denominator,
+            group_by={"pf_status": has_pharmacy_first, "imd": imd_quintile},
+        )
+    return measures
+
+
+def pf_descriptive_stats(context):
+    tables = context.tables
+    intervals = get_intervals(
+        config.start_date_measure_descriptive_stats,
+        config.monthly_intervals_measure_descriptive_stats,
+    )
+    grid = IntervalGrid(tables["patients"]["patient_id"], intervals)
+    measures = Measures(grid)
+    measures.configure_disclosure_control(enabled=True)
+
+    denominator = context.populations.pf_consulting(grid)
+    selected_events = in_intervals(tables["clinical_events"], intervals)
+    selected_medications = in_intervals(tables["medications"], intervals)
+    event_codes = selected_events["snomedct_code"]
+    medication_codes = selected_medications["dmd_code"]
+
+    pf_consultation_events = selected_events[is_in(event_codes, pf_services_codes)]
+    pf_mi_events = selected_events[
+        is_in(
+            event_codes, pf_consultation_events_dict["pf_consultation_cp_minorillness"]
+        )
+    ]
+    pf_consultation_count = grid.count_for_patient(pf_consultation_events)
+
+    in_pf_ids = is_in_for_patient(
+        selected_events, "consultation_id", pf_consultation_events, "consultation_id"
+    )
+    in_pf_mi_ids = is_in_for_patient(
+        selected_events, "consultation_id", pf_mi_events, "consultation_id"
+    )
+    is_pf_condition = is_in(event_codes, pf_conditions_codelist)
+    selected_pf_id_conditions = selected_events[in_pf_ids & is_pf_condition]
+    selected_pf_mi_id_conditions = selected_events[in_pf_mi_ids & is_pf_condition]
+    selected_pf_id_non_pf_events = selected_events[
+        in_pf_ids & ~is_pf_condition & ~is_in(event_codes, pf_services_codes)
+    ]
+    nonpf_event_count = grid.count_for_patient(selected_pf_id_non_pf_events)
+
+    med_in_pf_ids = is_in_for_patient(
+        selected_medications,
+        "consultation_id",
+        pf_consultation_events,
+        "consultation_id",
+    )
+    med_in_pf_mi_ids = is_in_for_patient(
+        selected_medications, "consultation_id", pf_mi_events, "consultation_id"
+    )
+    is_pf_medication = is_in(medication_codes, pf_med_codelist)
+    selected_pf_id_medications = selected_medications[med_in_pf_ids & is_pf_medication]
+    selected_pf_mi_id_medications = selected_medications[
+        med_in_pf_mi_ids & is_pf_medication
+    ]
+    nonpf_med_count = grid.count_distinct_for_patient(
+        selected_medications[med_in_pf_ids & ~is_pf_medication], "consultation_id"
+    )
+
+    def count_linked(medications, conditions):
+        # PF consultations with (1) a PF medication only, (2) a PF condition
+        # only and (3) both
+        med_only = medications[
+            is_not_in_for_patient(
+                medications, "consultation_id", conditions, "consultation_id"
+            )
+        ]
+        condition_only = conditions[
+            is_not_in_for_patient(
+                conditions, "consultation_id", medications, "consultation_id"
+            )
+        ]
+        both = medications[
+            is_in_for_patient(
+                medications, "consultation_id", conditions, "consultation_id"
+            )
+        ]
+        return [
+            grid.count_distinct_for_patient(events, "consultation_id")
+            for events in (med_only, condition_only, both)
+        ]
+
+    count_pf_med_only, count_pf_condition_only, count_pf_both = count_linked(
+        selected_pf_id_medications, selected_pf_id_conditions
+    )
+    count_pf_mi_med_only, count_pf_mi_condition_only, count_pf_mi_both = count_linked(
+        selected_pf_mi_id_medications, selected_pf_mi_id_conditions
+    )
+
+    for name, numerator in {
+        "pfmed_with_pfid": count_pf_med_only,
+        "pfcondition_with_pfid": count_pf_condition_only,
+        "pfmed_and_pfcondition_with_pfid": count_pf_both,
+        "pfmed_with_pfid_mi": count_pf_mi_med_only,
+        "pfcondition_with_pfid_mi": count_pf_mi_condition_only,
+        "pfmed_and_pfcondition_with_pfid_mi": count_pf_mi_both,
+        "pfconsultations_with_pfid_count": pf_consultation_count,
+        "non_pfevents_with_pfid_count": nonpf_event_count,
+        "non_pfmed_with_pfid_count": nonpf_med_count,
+    }.items():
+        measures.define_measure(name=name, numerator=numerator, denominator=denominator)
+    return measures
+
+
+def pf_med_counts(context):
+    tables = context.tables
+    intervals = get_intervals(
+        config.start_date_measure_med_counts,
+        config.monthly_intervals_measure_med_counts,
+    )
+    grid = IntervalGrid(tables["patients"]["patient_id"], intervals)
+    measures = Measures(grid)
+
+    selected_events = in_intervals(tables["clinical_events"], intervals)
+    pharmacy_first_events = selected_events[
+        is_in(selected_events["snomedct_code"], pf_services_codes)
+    ]
+
+    interval_medications = in_intervals(tables["medications"], intervals)
+    selected_medications = interval_medications[
+        is_in_for_patient(
+            interval_medications,
+            "consultation_id",
+            pharmacy_first_events,
+            "consultation_id",
+        )
+    ]
+    first_selected_medication = grid.first_for_patient(
+        selected_medications, "date", "dmd_code"
+    )
+    has_medication = pd.notna(first_selected_medication)
+    has_pharmacy_first_medication = np.full(len(grid), None, dtype=object)
+    has_pharmacy_first_medication[has_medication] = is_in(
+        first_selected_medication[has_medication], pf_med_codelist
+    )
+
+    measures.define_measure(
+        name="pf_medication_count",
+        numerator=has_medication,
+        denominator=context.populations.pf_consulting(grid),
+        group_by={
+            "dmd_code": first_selected_medication,
+            "pharmacy_first_med": has_pharmacy_first_medication,
+        },
+    )
+    return measures
+
+
+DEFINITIONS = {
+    "pf_breakdown": pf_breakdown,
+    "pf_condition_provider": pf_condition_provider,
+    "pf_descriptive_stats": pf_descriptive_stats,
+    "pf_med_counts": pf_med_counts,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("definition", choices=DEFINITIONS)
+    parser.add_argument("--dummy-tables", default="dummy_tables")
+    parser.add_argument(
+        "--extract-dir",
+        help="partitioned extract to read clinical_events and medications from",
+    )
+    parser.add_argument("--output")
+    parser.add_argument(
+        "--compare", help="ehrQL measures output to cross-check against"
+    )
+    args = parser.parse_args()
+
+    context = EvaluationContext(load_tables(args.dummy_tables, args.extract_dir))
+    results = DEFINITIONS[args.definition](context).results()
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        results.to_csv(args.output, index=False)
+    if args.compare:
+        differences = compare_measures(results, args.compare)
+        if not differences.empty:
+            print(differences.to_string(index=False))
+            sys.exit(f"{len(differences)} rows differ from {args.compare}")
+        print(f"All {len(results)} rows match {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
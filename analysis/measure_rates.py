@@ -0,0 +1,179 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from merge_measures import expand_paths
+
+# Rates and derived statistics for measures outputs, computed once instead of
+# in each report. Each file is read in chunks, and for every row this adds:
+#   - rate_per_1000: numerator / denominator * 1,000
+#   - wilson_lower, wilson_upper: Wilson score interval for the ratio, per
+#     1,000 (only where the numerator is at most the denominator)
+#   - poisson_lower, poisson_upper: interval for the numerator as a Poisson
+#     count (Byar's approximation), as a rate per 1,000
+#   - numerator_change, rate_change: change since the previous month of the
+#     same measure and group, when there is a row for it
+#   - numerator_rolling_mean, rate_rolling_mean: mean over the last --window
+#     months of the same measure and group, when all are present
+# Intervals are months, and the previous months are found by interval_start,
+# so a series with a missing month (e.g. an empty denominator) has no change
+# or rolling mean across the gap. Rows of each measure and group must be in
+# interval order, as ehrQL and merge_measures.py write them. The last rows of
+# each series are carried over to the next chunk, so memory is bounded by the
+# chunk size and the number of series.
+#
+# Run with:
+#   python analysis/measure_rates.py "output/disclosure_control/measures/*.csv"
+
+OUTPUT_DIR = Path("output/measures/rates")
+CHUNK_SIZE = 1_000_000
+WINDOW = 3
+Z = 1.959964  # 95% intervals
+
+VALUE_COLUMNS = ["ratio", "numerator", "denominator"]
+KEY_COLUMNS = ["measure", "interval_start", "interval_end"]
+
+
+def get_group_columns(columns):
+    return [column for column in columns if column not in KEY_COLUMNS + VALUE_COLUMNS]
+
+
+def wilson_interval(numerator, denominator, z=Z):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = numerator / denominator
+        z2_n = z**2 / denominator
+        centre = (p + z2_n / 2) / (1 + z2_n)
+        half_width = (
+            z * np.sqrt(p * (1 - p) / denominator + z2_n / (4 * denominator))
+        ) / (1 + z2_n)
+    valid = (denominator > 0) & (numerator >= 0) & (numerator <= denominator)
+    return (
+        np.where(valid, centre - half_width, np.nan),
+        np.where(valid, centre + half_width, np.nan),
+    )
+
+
+def poisson_interval(numerator, z=Z):
+    # Byar's approximation to the exact interval for a Poisson count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lower = (
+            numerator * (1 - 1 / (9 * numerator) - z / (3 * np.sqrt(numerator))) ** 3
+        )
+        upper = (numerator + 1) * (
+            1 - 1 / (9 * (numerator + 1)) + z / (3 * np.sqrt(numerator + 1))
+        ) ** 3
+    lower = np.where(numerator == 0, 0.0, lower)
+    valid = numerator >= 0
+    return np.where(valid, lower, np.nan), np.where(valid, upper, np.nan)
+
+
+def get_months(interval_start):
+    # Months since 1970-01 of each interval start
+    return interval_start.astype("datetime64[M]").astype(np.int64)
+
+
+def lagged(values, series, months, lag):
+    """
+    values of the row lag months earlier in the same series, or NaN where
+    there is none, for rows sorted by series and then month
+    """
+    keys = series.astype(np.int64) << 32 | months
+    positions = np.minimum(np.searchsorted(keys, keys - lag), len(keys) - 1)
+    found = keys[positions] == keys - lag
+    return np.where(found, values[positions], np.nan)
+
+
+def add_rates(chunk, group_columns, window=WINDOW):
+    """
+    Add the rate and interval columns and, for rows sorted by series and then
+    interval, the change and rolling mean columns
+    """
+    numerator = pd.to_numeric(chunk["numerator"]).to_numpy(dtype=float)
+    denominator = pd.to_numeric(chunk["denominator"]).to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(denominator > 0, numerator / denominator * 1000, np.nan)
+        per_1000 = np.where(denominator > 0, 1000 / denominator, np.nan)
+
+    series = chunk.groupby(
+        ["measure"] + group_columns, sort=False, dropna=False
+    ).ngroup()
+    order = np.argsort(series.to_numpy(), kind="stable")
+    series = series.to_numpy()[order]
+    interval_start = pd.to_datetime(chunk["interval_start"]).to_numpy()[order]
+    out_of_order = (series[1:] == series[:-1]) & (
+        interval_start[1:] <= interval_start[:-1]
+    )
+    if out_of_order.any():
+        raise ValueError(
+            "Rows of each measure and group must be in interval order, e.g.\n"
+            f"{chunk.iloc[order[1:][out_of_order][:5]].to_string(index=False)}"
+        )
+
+    months = get_months(interval_start)
+    sorted_numerator = numerator[order]
+    sorted_rate = rate[order]
+    numerator_lags = [sorted_numerator] + [
+        lagged(sorted_numerator, series, months, lag) for lag in range(1, window)
+    ]
+    rate_lags = [sorted_rate] + [
+        lagged(sorted_rate, series, months, lag) for lag in range(1, window)
+    ]
+    derived = {
+        "numerator_change": sorted_numerator
+        - lagged(sorted_numerator, series, months, 1),
+        "rate_change": sorted_rate - lagged(sorted_rate, series, months, 1),
+        # NaN unless all window months are present
+        "numerator_rolling_mean": np.mean(numerator_lags, axis=0),
+        "rate_rolling_mean": np.mean(rate_lags, axis=0),
+    }
+    unsorted = np.empty_like(order)
+    unsorted[order] = np.arange(len(order))
+
+    wilson_lower, wilson_upper = wilson_interval(numerator, denominator)
+    poisson_lower, poisson_upper = poisson_interval(numerator)
+    return chunk.assign(
+        rate_per_1000=rate,
+        wilson_lower=wilson_lower * 1000,
+        wilson_upper=wilson_upper * 1000,
+        poisson_lower=poisson_lower * per_1000,
+        poisson_upper=poisson_upper * per_1000,
+        **{name: values[unsorted] for name, values in derived.items()},
+    )
+
+
+def measure_rates(path, output_path, chunk_size=CHUNK_SIZE, window=WINDOW):
+    """Write path with the rate columns added, chunk by chunk"""
+    chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    carried = None
+    for position, chunk in enumerate(chunks):
+        group_columns = get_group_columns(chunk.columns)
+        n_carried = 0 if carried is None else len(carried)
+        chunk = pd.concat([carried, chunk]) if n_carried else chunk
+        with_rates = add_rates(chunk, group_columns, window).iloc[n_carried:]
+        with_rates.to_csv(
+            output_path, mode="a" if position else "w", header=not position, index=False
+        )
+        # The last rows of each series hold the lags for the next chunk
+        carried = chunk.groupby(
+            ["measure"] + group_columns, sort=False, dropna=False
+        ).tail(max(window - 1, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("measures", nargs="+", help="Measures files or glob patterns")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--window", type=int, default=WINDOW)
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for path in expand_paths(args.measures):
+        measure_rates(path, output_dir / path.name, args.chunk_size, args.window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+from datetime import date
+
+# Splitting a measures definition's monthly intervals into contiguous shards
+# that run as separate actions, e.g.
+#   ehrql:v1 generate-measures analysis/measures_definition_pf_breakdown.py
+#   --output output/measures/shards/pf_breakdown_measures_shard_1.csv
+#   -- --shard 1 --num-shards 3
+# merge_measures.py then combines the shard outputs into one file.
+
+
+def parse_shard_args():
+    # Arguments after -- in the ehrQL command. Unknown arguments are ignored, as
+    # definitions importing another definition (e.g. condition provider
+    # importing breakdown) are parsed with the importing definition's arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard", type=int, default=1)
+    parser.add_argument("--num-shards", type=int, default=1)
+    # Measure families (e.g. services or conditions) and breakdowns to define;
+    # each can be repeated, and all are defined if none are given
+    parser.add_argument("--family", action="append")
+    parser.add_argument("--breakdown", action="append")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def add_months(start_date, num_months):
+    # As ehrQL's date + months(n): days that do not exist in the target month
+    # roll forward to the first day of the following month
+    start = date.fromisoformat(str(start_date))
+    month = start.year * 12 + start.month - 1 + num_months
+    year, month = divmod(month, 12)
+    first_of_month = date(year, month + 1, 1)
+    try:
+        return first_of_month.replace(day=start.day).isoformat()
+    except ValueError:
+        return add_months(first_of_month.isoformat(), 1)
+
+
+def get_interval_shards(start_date, monthly_intervals, num_shards):
+    """
+    Split monthly_intervals months from start_date into num_shards contiguous
+    (start_date, monthly_intervals) ranges, as equal as possible, with earlier
+    shards taking any extra month
+    """
+    if not 1 <= num_shards <= monthly_intervals:
+        raise ValueError(
+            f"num_shards must be between 1 and {monthly_intervals}, got {num_shards}"
+        )
+    shard_size, extra = divmod(monthly_intervals, num_shards)
+    shards = []
+    offset = 0
+    for shard in range(num_shards):
+        shard_intervals = shard_size + (1 if shard < extra else 0)
+        shards.append((add_months(start_date, offset), shard_intervals))
+        offset += shard_intervals
+    return shards
+
+
+def get_interval_shard(start_date, monthly_intervals, shard=None, num_shards=None):
+    """
+    The (start_date, monthly_intervals) range of one shard, numbered from 1.
+    Defaults to the shard given on the command line, which is the whole range
+    unless --shard and --num-shards are passed.
+    """
+    if shard is None or num_shards is None:
+        args = parse_shard_args()
+        shard, num_shards = args.shard, args.num_shards
+    if not 1 <= shard <= num_shards:
+        raise ValueError(f"shard must be between 1 and {num_shards}, got {shard}")
+    return get_interval_shards(start_date, monthly_intervals, num_shards)[shard - 1]
+
+
+def select_measure_families(available, selected=None, kind="measure families"):
+    """
+    The families (or other options, named by kind in errors) in available
+    that were selected, in the order of available, or all of them if none
+    were selected
+    """
+    if not selected:
+        return list(available)
+    unknown = set(selected) - set(available)
+    if unknown:
+        raise ValueError(
+            f"Unknown {kind} {sorted(unknown)}, expected some of {list(available)}"
+        )
+    return [family for family in available if family in selected]
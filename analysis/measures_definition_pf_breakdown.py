@@ -1,7 +1,6 @@
 from ehrql import INTERVAL, create_measures, months, case, when
 from ehrql.tables.tpp import (
     clinical_events,
-    practice_registrations,
     patients,
     addresses,
     ethnicity_from_sus,
@@ -12,20 +11,27 @@ from codelists import (
 )
 
 from pf_dataset import get_latest_ethnicity
+from pf_denominators import registered_population, registration
 from codelists import pf_consultation_events_dict
 from config import (
     start_date_measure_pf_breakdown,
     monthly_intervals_measure_pf_breakdown,
 )
+from measure_shards import (
+    get_interval_shard,
+    parse_shard_args,
+    select_measure_families,
+)
 from pf_variables_library import select_events
 
 measures = create_measures()
 measures.configure_dummy_data(population_size=1000)
 
-start_date = start_date_measure_pf_breakdown
-monthly_intervals = monthly_intervals_measure_pf_breakdown
+# Whole interval range unless run with -- --shard N --num-shards M
+start_date, monthly_intervals = get_interval_shard(
+    start_date_measure_pf_breakdown, monthly_intervals_measure_pf_breakdown
+)
 
-registration = practice_registrations.for_patient_on(INTERVAL.end_date)
 ethnicity_combined = get_latest_ethnicity(
     index_date=INTERVAL.start_date,
     clinical_events=clinical_events,
@@ -69,8 +75,11 @@ pharmacy_first_ids = select_events(
 
 # # Select clinical events in interval date range
 selected_events = select_events(
-    clinical_events, start_date=INTERVAL.start_date, end_date=INTERVAL.end_date
-).where(clinical_events.consultation_id.is_in(pharmacy_first_ids))
+    clinical_events,
+    consultation_ids=pharmacy_first_ids,
+    start_date=INTERVAL.start_date,
+    end_date=INTERVAL.end_date,
+)
 
 # Breakdown metrics to be produced as graphs
 breakdown_metrics = {
@@ -81,21 +90,37 @@ breakdown_metrics = {
     "ethnicity": ethnicity_combined,
 }
 
+# Measure families and breakdowns to define: all of them, unless run with
+# e.g. -- --family services --breakdown total --breakdown sex
+shard_args = parse_shard_args()
+measure_families = select_measure_families(
+    ["services", "conditions"], shard_args.family
+)
+selected_breakdowns = select_measure_families(
+    ["total", *breakdown_metrics], shard_args.breakdown, kind="breakdowns"
+)
+selected_breakdown_metrics = {
+    breakdown: variable
+    for breakdown, variable in breakdown_metrics.items()
+    if breakdown in selected_breakdowns
+}
+
 pf_consultation_events = select_events(
     selected_events,
     codelist=pf_consultation_events_dict["pf_consultation_services_combined"],
 )
 has_pf_consultation = pf_consultation_events.exists_for_patient()
 
-# Define the denominator as the number of patients registered
-denominator = (
-    registration.exists_for_patient()
-    & patients.sex.is_in(["male", "female"])
-    & has_pf_consultation
-)
+# Define the denominator as the number of patients registered. Unlike
+# pf_denominators.has_pf_consultation, only Pharmacy First events with a
+# consultation_id count here, as for the numerators.
+denominator = registered_population & has_pf_consultation
 
 # Create measures for pharmacy first services
-for pharmacy_first_event, codelist in pf_consultation_events_dict.items():
+selected_services = (
+    pf_consultation_events_dict if "services" in measure_families else {}
+)
+for pharmacy_first_event, codelist in selected_services.items():
     condition_events = selected_events.where(
         selected_events.snomedct_code.is_in(codelist)
     )
@@ -104,15 +129,16 @@ for pharmacy_first_event, codelist in pf_consultation_events_dict.items():
     numerator = condition_events.count_for_patient()
 
     # Measures for overall clinical services graph
-    measures.define_measure(
-        name=f"count_{pharmacy_first_event}",
-        numerator=numerator,
-        denominator=denominator,
-        intervals=months(monthly_intervals).starting_on(start_date),
-    )
+    if "total" in selected_breakdowns:
+        measures.define_measure(
+            name=f"count_{pharmacy_first_event}",
+            numerator=numerator,
+            denominator=denominator,
+            intervals=months(monthly_intervals).starting_on(start_date),
+        )
 
     # Nested loop for each breakdown measure in clinical services
-    for breakdown, variable in breakdown_metrics.items():
+    for breakdown, variable in selected_breakdown_metrics.items():
         measures.define_measure(
             name=f"count_{pharmacy_first_event}_by_{breakdown}",
             numerator=numerator,
@@ -139,7 +165,10 @@ for codes, term in pf_conditions_codelist.items():
     codes = [codes]
     pharmacy_first_conditions_codes[normalised_term] = codes
 
-for condition_name, condition_code in pharmacy_first_conditions_codes.items():
+selected_conditions_codes = (
+    pharmacy_first_conditions_codes if "conditions" in measure_families else {}
+)
+for condition_name, condition_code in selected_conditions_codes.items():
     condition_events = selected_events.where(
         selected_events.snomedct_code.is_in(condition_code)
     )
@@ -148,15 +177,16 @@ for condition_name, condition_code in pharmacy_first_conditions_codes.items():
     numerator = condition_events.count_for_patient()
 
     # Measures for overall clinical services graph
-    measures.define_measure(
-        name=f"count_{condition_name}",
-        numerator=numerator,
-        denominator=pf_condition_denominators[condition_name],
-        intervals=months(monthly_intervals).starting_on(start_date),
-    )
+    if "total" in selected_breakdowns:
+        measures.define_measure(
+            name=f"count_{condition_name}",
+            numerator=numerator,
+            denominator=pf_condition_denominators[condition_name],
+            intervals=months(monthly_intervals).starting_on(start_date),
+        )
 
     # Nested loop for each breakdown measure in clinical conditions
-    for breakdown, variable in breakdown_metrics.items():
+    for breakdown, variable in selected_breakdown_metrics.items():
         measures.define_measure(
             name=f"count_{condition_name}_by_{breakdown}",
             numerator=numerator,
@@ -1,7 +1,9 @@
 from ehrql import INTERVAL, create_measures, months
 from ehrql.tables.raw.tpp import medications
-from ehrql.tables.tpp import practice_registrations, patients, clinical_events
+from ehrql.tables.tpp import clinical_events
 
+from measure_shards import get_interval_shard
+from pf_denominators import pf_consultation_events, pf_population
 from pf_variables_library import select_events
 from codelists import (
     pf_med_codelist,
@@ -17,10 +19,10 @@ measures = create_measures()
 measures.configure_dummy_data(population_size=100)
 measures.configure_disclosure_control(enabled=True)
 
-start_date = start_date_measure_descriptive_stats
-monthly_intervals = monthly_intervals_measure_descriptive_stats
-
-registration = practice_registrations.for_patient_on(INTERVAL.end_date)
+# Whole interval range unless run with -- --shard N --num-shards M
+start_date, monthly_intervals = get_interval_shard(
+    start_date_measure_descriptive_stats, monthly_intervals_measure_descriptive_stats
+)
 
 # Select clinical events and medications for measures INTERVAL
 selected_events = clinical_events.where(
@@ -36,20 +38,15 @@ selected_medications = medications.where(
     )
 )
 
-# Select all Pharmacy First consultation events
-pf_consultation_events = select_events(
-    selected_events,
-    codelist=pf_consultation_events_dict["pf_consultation_services_combined"],
-)
 # Select minor illness (mi) code event
 pf_mi_events = select_events(
     selected_events,
     codelist=pf_consultation_events_dict["pf_consultation_cp_minorillness"],
 )
 
-# Extract Pharmacy First consultation IDs
+# Extract Pharmacy First consultation IDs (pf_consultation_events are all
+# Pharmacy First consultation events in the interval, from pf_denominators.py)
 pf_ids = pf_consultation_events.consultation_id
-has_pf_consultation = pf_consultation_events.exists_for_patient()
 
 # Counts number of Pharmacy First consultations
 pf_consultation_count = pf_consultation_events.count_for_patient()
@@ -153,11 +150,7 @@ count_pf_mi_both = selected_pf_mi_id_medications.where(
 
 # Define defaults for measures
 measures.define_defaults(
-    denominator=(
-        registration.exists_for_patient()
-        & patients.sex.is_in(["male", "female"])
-        & has_pf_consultation
-    ),
+    denominator=pf_population,
     intervals=months(monthly_intervals).starting_on(start_date),
 )
 
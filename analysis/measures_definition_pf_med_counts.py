@@ -1,16 +1,10 @@
 from ehrql import INTERVAL, create_measures, months
-from ehrql.tables.tpp import (
-    patients,
-    clinical_events,
-    practice_registrations,
-)
 from ehrql.tables.raw.tpp import medications
 
 from config import start_date_measure_med_counts, monthly_intervals_measure_med_counts
-from codelists import (
-    pf_consultation_events_dict,
-    pf_med_codelist,
-)
+from codelists import pf_med_codelist
+from measure_shards import get_interval_shard
+from pf_denominators import pf_consultation_events, pf_population
 from pf_variables_library import select_events
 
 # Script taken from Pharmacy First Data Development (for top 10 PF meds table)
@@ -18,27 +12,21 @@ from pf_variables_library import select_events
 measures = create_measures()
 measures.configure_dummy_data(population_size=1000)
 
-start_date = start_date_measure_med_counts
-monthly_intervals = monthly_intervals_measure_med_counts
-
-registration = practice_registrations.for_patient_on(INTERVAL.end_date)
-
-# Select Pharmacy First events during interval date range
-pharmacy_first_events = select_events(
-    clinical_events, start_date=INTERVAL.start_date, end_date=INTERVAL.end_date
-).where(
-    clinical_events.snomedct_code.is_in(
-        pf_consultation_events_dict["pf_consultation_services_combined"]
-    )
+# Whole interval range unless run with -- --shard N --num-shards M
+start_date, monthly_intervals = get_interval_shard(
+    start_date_measure_med_counts, monthly_intervals_measure_med_counts
 )
 
-pharmacy_first_ids = pharmacy_first_events.consultation_id
-has_pf_consultation = pharmacy_first_events.exists_for_patient()
+# Pharmacy First events during interval date range
+pharmacy_first_ids = pf_consultation_events.consultation_id
 
 # Select Pharmacy First consultations during interval date range
 selected_medications = select_events(
-    medications, start_date=INTERVAL.start_date, end_date=INTERVAL.end_date
-).where(medications.consultation_id.is_in(pharmacy_first_ids))
+    medications,
+    consultation_ids=pharmacy_first_ids,
+    start_date=INTERVAL.start_date,
+    end_date=INTERVAL.end_date,
+)
 
 # First medication for each patient
 first_selected_medication = (
@@ -52,11 +40,7 @@ has_pharmacy_first_medication = first_selected_medication.is_in(pf_med_codelist)
 numerator = first_selected_medication.is_not_null()
 
 # Denominator, registered patients (f/m) with a PF consultation
-denominator = (
-    registration.exists_for_patient()
-    & patients.sex.is_in(["male", "female"])
-    & has_pf_consultation
-)
+denominator = pf_population
 
 measures.define_measure(
     name="pf_medication_count",
@@ -0,0 +1,85 @@
+import argparse
+import glob
+import re
+from pathlib import Path
+
+import pandas as pd
+
+# Merge measures outputs produced in shards (see measure_shards.py) into a
+# single file. Shards can split the intervals, the measure families or both.
+# Rows are ordered by measure, in the order measures first appear in the
+# shards (so pass measure family shards in definition order), and then by
+# interval, keeping each shard's row order within an interval, so the result
+# does not depend on which shard finished first.
+# Run with:
+#   python analysis/merge_measures.py --output output/measures/pf_breakdown_measures.csv \
+#     "output/measures/shards/pf_breakdown_measures_services_shard_*.csv" \
+#     "output/measures/shards/pf_breakdown_measures_conditions_shard_*.csv"
+
+KEY_COLUMNS = ["measure", "interval_start", "interval_end"]
+
+
+def natural_sort_key(path):
+    # shard_2 before shard_10
+    return [
+        int(part) if part.isdigit() else part for part in re.split(r"(\d+)", str(path))
+    ]
+
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) or [pattern]
+        paths.extend(sorted(matches, key=natural_sort_key))
+    return [Path(path) for path in paths]
+
+
+def merge_measures(paths):
+    # Values are kept as the strings ehrQL wrote, so merged rows are identical
+    # to those in the shard files
+    shards = [
+        pd.read_csv(path, dtype=str, keep_default_na=False).assign(_shard=shard)
+        for shard, path in enumerate(paths)
+    ]
+    columns = []
+    for shard in shards:
+        columns.extend(column for column in shard.columns if column not in columns)
+    merged = pd.concat(shards, ignore_index=True).reindex(columns=columns)
+    merged = merged.fillna("")
+
+    group_columns = [
+        column
+        for column in columns
+        if column not in KEY_COLUMNS + ["ratio", "numerator", "denominator", "_shard"]
+    ]
+    duplicated = merged.duplicated(KEY_COLUMNS + group_columns, keep=False)
+    if duplicated.any():
+        raise ValueError(
+            f"{duplicated.sum()} rows appear in more than one shard, e.g.\n"
+            f"{merged[duplicated].head().to_string(index=False)}"
+        )
+
+    measure_order = {
+        measure: position
+        for position, measure in enumerate(merged["measure"].drop_duplicates())
+    }
+    merged["_measure_order"] = merged["measure"].map(measure_order)
+    merged = merged.sort_values(
+        ["_measure_order", "interval_start", "_shard"], kind="stable"
+    )
+    return merged.drop(columns=["_measure_order", "_shard"]).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("shards", nargs="+", help="Shard files or glob patterns")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    merged = merge_measures(expand_paths(args.shards))
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    merged.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+import config
+from local_engine import (
+    AsOfIndexes,
+    IntervalGrid,
+    Measures,
+    case,
+    get_age_band,
+    get_ethnicity_group6,
+    get_imd_quintile,
+    get_intervals,
+    get_registered_population,
+    in_intervals,
+)
+
+# Local aggregation of the event-level export written by
+# dataset_definition_pf_consultations.py. build_consultations reduces it to one
+# row per Pharmacy First consultation and interval, with counts of the events
+# of each service and condition, medication flags and the patient's demographic
+# breakdowns for the interval. The breakdown, descriptive stats and medication
+# count measures are then group-bys over those rows, and match the
+# measures_definition_pf_*.py outputs for the same intervals. New cuts only need
+# a new group-by, not a new measures definition.
+#
+# Run with:
+#   python analysis/pf_consultations.py
+
+DATASET_DIR = Path("output/pf_consultations/tables")
+OUTPUT_DIR = Path("output/pf_consultations")
+PF_CONDITIONS_CODELIST_PATH = (
+    "codelists/user-chriswood-pharmacy-first-clinical-pathway-conditions.csv"
+)
+
+# Services of pf_consultation_events_dict in codelists.py
+PF_SERVICES = [
+    "pf_consultation_cp_minorillness",
+    "pf_consultation_service",
+    "pf_consultation_cp_service",
+]
+PF_SERVICES_COMBINED = "pf_consultation_services_combined"
+
+BREAKDOWNS = ["age_band", "sex", "imd", "region", "ethnicity"]
+
+# Table name -> date columns
+DATASET_TABLES = {
+    "consultation_events": ["date"],
+    "consultation_medications": ["date"],
+    "ethnicity_events": ["date"],
+    "practice_registrations": ["start_date", "end_date"],
+    "addresses": ["start_date", "end_date"],
+}
+
+
+def get_pf_conditions(codelist_path=PF_CONDITIONS_CODELIST_PATH):
+    # Condition term -> measure name, as in measures_definition_pf_breakdown.py
+    terms = pd.read_csv(codelist_path, dtype=str)["term"]
+    return {term: term.lower().replace(" ", "_") for term in terms}
+
+
+def load_dataset(path=DATASET_DIR):
+    path = Path(path)
+    dataset = {}
+    for table, date_columns in DATASET_TABLES.items():
+        frame = feather.read_table(path / f"{table}.arrow").to_pandas()
+        for column in date_columns:
+            frame[column] = pd.to_datetime(frame[column])
+        if "consultation_id" in frame.columns:
+            frame["consultation_id"] = frame["consultation_id"].astype("Int64")
+        dataset[table] = frame
+
+    patients = feather.read_table(path / "dataset.arrow").to_pandas()
+    patients["date_of_birth"] = pd.to_datetime(patients["date_of_birth"])
+    dataset["patients"] = patients[["patient_id", "date_of_birth", "sex"]]
+    dataset["ethnicity_from_sus"] = patients[
+        ["patient_id", "ethnicity_from_sus"]
+    ].rename(columns={"ethnicity_from_sus": "code"})
+    return dataset
+
+
+def get_default_intervals():
+    return get_intervals(
+        config.start_date_pf_consultations, config.monthly_intervals_pf_consultations
+    )
+
+
+def get_count_columns(pf_conditions):
+    # Count column of each service and condition measure, in definition order
+    return {
+        name: f"n_{name}"
+        for name in [*PF_SERVICES, PF_SERVICES_COMBINED, *pf_conditions.values()]
+    }
+
+
+def count_events(events, pf_conditions):
+    # Count column -> whether each event counts towards it
+    count_columns = get_count_columns(pf_conditions)
+    service = events["service"].to_numpy(dtype=object)
+    condition = events["condition"].map(pf_conditions).to_numpy(dtype=object)
+    return {
+        **{count_columns[name]: service == name for name in PF_SERVICES},
+        count_columns[PF_SERVICES_COMBINED]: pd.notna(service),
+        **{count_columns[name]: condition == name for name in pf_conditions.values()},
+        "n_other_events": pd.isna(service) & pd.isna(condition),
+    }
+
+
+def build_consultations(dataset, intervals, pf_conditions=None):
+    """
+    One row per patient, interval and consultation_id, for the consultations
+    with events in the interval. Pharmacy First events without a consultation_id
+    are counted in one row per patient and interval with a missing
+    consultation_id.
+    """
+    pf_conditions = pf_conditions or get_pf_conditions()
+    keys = ["patient_id", "interval", "consultation_id"]
+
+    events = in_intervals(dataset["consultation_events"], intervals)
+    counts = count_events(events, pf_conditions)
+    consultations = (
+        events[keys + ["date"]]
+        .assign(**counts)
+        .groupby(keys, dropna=False, sort=True)
+        .agg({"date": "min", **{column: "sum" for column in counts}})
+        .astype({column: np.int32 for column in counts})
+        .reset_index()
+    )
+
+    # Medications never match a missing consultation_id
+    medications = in_intervals(dataset["consultation_medications"], intervals)
+    medications = medications[medications["consultation_id"].notna()]
+    is_pf_medication = medications["pf_medication"].fillna(False).astype(bool)
+    medication_flags = (
+        medications[keys]
+        .assign(
+            has_pf_medication=is_pf_medication.to_numpy(),
+            has_other_medication=~is_pf_medication.to_numpy(),
+        )
+        .groupby(keys, sort=False)
+        .any()
+    )
+    first_medication = (
+        medications.sort_values("date", kind="stable")
+        .drop_duplicates(keys)
+        .set_index(keys)[["date", "dmd_code", "pf_medication"]]
+        .rename(
+            columns={
+                "date": "first_medication_date",
+                "dmd_code": "first_medication_code",
+                "pf_medication": "first_medication_is_pf",
+            }
+        )
+    )
+    consultations = consultations.merge(
+        medication_flags.join(first_medication).reset_index(), how="left", on=keys
+    )
+    for column in ["has_pf_medication", "has_other_medication"]:
+        consultations[column] = consultations[column].fillna(False).astype(bool)
+
+    grid = IntervalGrid(consultations["patient_id"], intervals)
+    rows = grid.rows(consultations)
+    indexes = AsOfIndexes(dataset)
+    registration, registered = get_registered_population(grid, dataset, indexes)
+    region = registration["practice_nuts1_region_name"]
+    breakdowns = {
+        "age_band": get_age_band(grid, dataset),
+        "sex": grid.patient_column(dataset["patients"], "sex"),
+        "imd": get_imd_quintile(grid, indexes),
+        "region": case(
+            [(region.notna(), region.to_numpy(dtype=object))], otherwise="Missing"
+        ),
+        "ethnicity": get_ethnicity_group6(
+            grid, dataset["ethnicity_events"], dataset["ethnicity_from_sus"]
+        ),
+    }
+    consultations.insert(
+        2,
+        "interval_start",
+        intervals["interval_start"].to_numpy()[consultations["interval"]],
+    )
+    consultations["registered"] = registered[rows]
+    for breakdown, values in breakdowns.items():
+        consultations[breakdown] = pd.Categorical(values[rows])
+    return consultations
+
+
+def _patient_interval_grid(consultations, intervals):
+    grid = IntervalGrid(consultations["patient_id"], intervals)
+    return grid, grid.rows(consultations)
+
+
+def _sum_for_patient(grid, rows, values, where):
+    return np.bincount(
+        rows[where], weights=np.asarray(values)[where], minlength=len(grid)
+    ).astype(np.int64)
+
+
+def _patient_values(grid, rows, values, default=None):
+    # Values that are the same for all of a patient's rows in an interval
+    result = np.full(len(grid), default, dtype=object)
+    result[rows] = np.asarray(values, dtype=object)
+    return result
+
+
+def breakdown_measures(consultations, intervals, pf_conditions=None):
+    # measures_definition_pf_breakdown.py
+    pf_conditions = pf_conditions or get_pf_conditions()
+    grid, rows = _patient_interval_grid(consultations, intervals)
+    measures = Measures(grid)
+
+    linked = consultations["consultation_id"].notna().to_numpy(bool)
+    combined = consultations[f"n_{PF_SERVICES_COMBINED}"]
+    has_pf_consultation = _sum_for_patient(grid, rows, combined, linked) > 0
+    registered = _patient_values(grid, rows, consultations["registered"], False)
+    denominator = registered.astype(bool) & has_pf_consultation
+    breakdowns = {
+        breakdown: _patient_values(grid, rows, consultations[breakdown])
+        for breakdown in BREAKDOWNS
+    }
+
+    for name, column in get_count_columns(pf_conditions).items():
+        numerator = _sum_for_patient(grid, rows, consultations[column], linked)
+        measures.define_measure(
+            name=f"count_{name}", numerator=numerator, denominator=denominator
+        )
+        for breakdown, variable in breakdowns.items():
+            measures.define_measure(
+                name=f"count_{name}_by_{breakdown}",
+                numerator=numerator,
+                denominator=denominator,
+                group_by={breakdown: variable},
+            )
+    return measures
+
+
+def descriptive_stats_measures(consultations, intervals, pf_conditions=None):
+    # measures_definition_pf_descriptive_stats.py
+    pf_conditions = pf_conditions or get_pf_conditions()
+    grid, rows = _patient_interval_grid(consultations, intervals)
+    measures = Measures(grid)
+    measures.configure_disclosure_control(enabled=True)
+
+    everywhere = np.ones(len(consultations), dtype=bool)
+    linked = consultations["consultation_id"].notna().to_numpy(bool)
+    combined = consultations[f"n_{PF_SERVICES_COMBINED}"].to_numpy()
+    minor_illness = consultations["n_pf_consultation_cp_minorillness"].to_numpy()
+    has_condition = (
+        consultations[[f"n_{name}" for name in pf_conditions.values()]].sum(axis=1) > 0
+    ).to_numpy(bool)
+    has_pf_medication = consultations["has_pf_medication"].to_numpy(bool)
+    has_other_medication = consultations["has_other_medication"].to_numpy(bool)
+
+    pf_consultation_count = _sum_for_patient(grid, rows, combined, everywhere)
+    registered = _patient_values(grid, rows, consultations["registered"], False)
+    denominator = registered.astype(bool) & (pf_consultation_count > 0)
+
+    def count_linked(pf_ids):
+        # PF consultations with (1) a PF medication only, (2) a PF condition
+        # only and (3) both
+        return [
+            _sum_for_patient(grid, rows, everywhere, pf_ids & selected)
+            for selected in (
+                has_pf_medication & ~has_condition,
+                has_condition & ~has_pf_medication,
+                has_pf_medication & has_condition,
+            )
+        ]
+
+    pf_ids = linked & (combined > 0)
+    pf_mi_ids = linked & (minor_illness > 0)
+    count_pf_med_only, count_pf_condition_only, count_pf_both = count_linked(pf_ids)
+    count_pf_mi_med_only, count_pf_mi_condition_only, count_pf_mi_both = count_linked(
+        pf_mi_ids
+    )
+    nonpf_event_count = _sum_for_patient(
+        grid, rows, consultations["n_other_events"], pf_ids
+    )
+    nonpf_med_count = _sum_for_patient(
+        grid, rows, everywhere, pf_ids & has_other_medication
+    )
+
+    for name, numerator in {
+        "pfmed_with_pfid": count_pf_med_only,
+        "pfcondition_with_pfid": count_pf_condition_only,
+        "pfmed_and_pfcondition_with_pfid": count_pf_both,
+        "pfmed_with_pfid_mi": count_pf_mi_med_only,
+        "pfcondition_with_pfid_mi": count_pf_mi_condition_only,
+        "pfmed_and_pfcondition_with_pfid_mi": count_pf_mi_both,
+        "pfconsultations_with_pfid_count": pf_consultation_count,
+        "non_pfevents_with_pfid_count": nonpf_event_count,
+        "non_pfmed_with_pfid_count": nonpf_med_count,
+    }.items():
+        measures.define_measure(name=name, numerator=numerator, denominator=denominator)
+    return measures
+
+
+def med_counts_measures(consultations, intervals):
+    # measures_definition_pf_med_counts.py. Where a patient's first medications
+    # in two consultations share a date, the lower consultation_id is used.
+    grid, rows = _patient_interval_grid(consultations, intervals)
+    measures = Measures(grid)
+
+    combined = consultations[f"n_{PF_SERVICES_COMBINED}"].to_numpy()
+    everywhere = np.ones(len(consultations), dtype=bool)
+    has_pf_consultation = _sum_for_patient(grid, rows, combined, everywhere) > 0
+    registered = _patient_values(grid, rows, consultations["registered"], False)
+
+    with_medication = (
+        consultations["consultation_id"].notna()
+        & (consultations[f"n_{PF_SERVICES_COMBINED}"] > 0)
+        & consultations["first_medication_date"].notna()
+    ).to_numpy(bool)
+    first = (
+        consultations[with_medication]
+        .assign(row=rows[with_medication])
+        .sort_values(["row", "first_medication_date", "consultation_id"])
+        .drop_duplicates("row")
+    )
+    first_selected_medication = np.full(len(grid), None, dtype=object)
+    first_selected_medication[first["row"]] = first["first_medication_code"].to_numpy(
+        dtype=object
+    )
+    has_pharmacy_first_medication = np.full(len(grid), None, dtype=object)
+    has_pharmacy_first_medication[first["row"]] = first[
+        "first_medication_is_pf"
+    ].to_numpy(dtype=object)
+
+    measures.define_measure(
+        name="pf_medication_count",
+        numerator=pd.notna(first_selected_medication),
+        denominator=registered.astype(bool) & has_pf_consultation,
+        group_by={
+            "dmd_code": first_selected_medication,
+            "pharmacy_first_med": has_pharmacy_first_medication,
+        },
+    )
+    return measures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    intervals = get_default_intervals()
+    pf_conditions = get_pf_conditions()
+    consultations = build_consultations(
+        load_dataset(args.dataset), intervals, pf_conditions
+    )
+    output_dir = Path(args.output_dir)
+    (output_dir / "measures").mkdir(parents=True, exist_ok=True)
+    consultations.to_parquet(output_dir / "consultations.parquet", index=False)
+
+    for name, measures in {
+        "pf_breakdown": breakdown_measures(consultations, intervals, pf_conditions),
+        "pf_descriptive_stats": descriptive_stats_measures(
+            consultations, intervals, pf_conditions
+        ),
+        "pf_medications": med_counts_measures(consultations, intervals),
+    }.items():
+        measures.results().to_csv(
+            output_dir / "measures" / f"{name}_measures.csv", index=False
+        )
+
+
+if __name__ == "__main__":
+    main()
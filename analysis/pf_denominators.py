@@ -0,0 +1,30 @@
+from ehrql import INTERVAL
+from ehrql.tables.tpp import clinical_events, patients, practice_registrations
+
+from codelists import pf_consultation_events_dict
+from pf_variables_library import select_events
+
+# Denominator populations shared by the measures_definition_pf_*.py files, so
+# each definition references the same registration and Pharmacy First status
+# for the interval rather than re-deriving them. local_measures.py evaluates
+# these with population_cache.py.
+
+# Registration on the interval's last day, also used for the region breakdown
+registration = practice_registrations.for_patient_on(INTERVAL.end_date)
+
+# Registered patients with a sex of male or female
+registered_population = registration.exists_for_patient() & patients.sex.is_in(
+    ["male", "female"]
+)
+
+# Pharmacy First consultation events recorded in the interval
+pf_consultation_events = select_events(
+    clinical_events,
+    codelist=pf_consultation_events_dict["pf_consultation_services_combined"],
+    start_date=INTERVAL.start_date,
+    end_date=INTERVAL.end_date,
+)
+has_pf_consultation = pf_consultation_events.exists_for_patient()
+
+# Registered patients with a Pharmacy First consultation in the interval
+pf_population = registered_population & has_pf_consultation
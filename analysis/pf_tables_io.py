@@ -0,0 +1,125 @@
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Streaming access to the patient-level population dataset written by
+# dataset_definition_tables.py. read_pf_tables yields typed batches of the
+# requested columns, so consumers hold one batch in memory at a time:
+#   - demographic strings as categoricals (empty values, i.e. missing, as NA)
+#   - has_pf_consultation and the condition numerators as nullable booleans
+#   - patient_id and age as nullable integers
+# write_columnar converts the gzipped CSV to a Parquet sibling file
+# (pf_tables.parquet) batch by batch. When the sibling is present and up to
+# date, read_pf_tables reads it instead, decoding only the requested columns.
+# Run with: python analysis/pf_tables_io.py
+
+DATASET_PATH = Path("output/population/pf_tables.csv.gz")
+CHUNK_SIZE = 1_000_000
+
+INTEGER_COLUMNS = ["patient_id", "age"]
+BOOLEAN_COLUMNS = [
+    "has_pf_consultation",
+    "uti_numerator",
+    "sinusitis_numerator",
+    "insectbite_numerator",
+    "otitismedia_numerator",
+    "sorethroat_numerator",
+    "shingles_numerator",
+    "impetigo_numerator",
+]
+# Any other column is read as a categorical
+
+
+def get_columnar_path(path):
+    path = Path(path)
+    return path.with_name(path.name.split(".")[0] + ".parquet")
+
+
+def is_current(columnar_path, path):
+    return (
+        columnar_path.exists()
+        and columnar_path.stat().st_mtime >= Path(path).stat().st_mtime
+    )
+
+
+def to_typed(chunk):
+    """Convert a chunk read as ehrQL's CSV strings to typed columns"""
+    typed = {}
+    for column, values in chunk.items():
+        values = values.mask(values == "")
+        if column in INTEGER_COLUMNS:
+            typed[column] = pd.to_numeric(values).astype("Int64")
+        elif column in BOOLEAN_COLUMNS:
+            typed[column] = values.map({"T": True, "F": False}).astype("boolean")
+        else:
+            typed[column] = values.astype("category")
+    return pd.DataFrame(typed, index=chunk.index)
+
+
+def get_arrow_type(column):
+    if column in INTEGER_COLUMNS:
+        return pa.int64()
+    if column in BOOLEAN_COLUMNS:
+        return pa.bool_()
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def read_csv_batches(path, columns=None, chunk_size=CHUNK_SIZE):
+    chunks = pd.read_csv(
+        path,
+        usecols=columns,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_size,
+    )
+    for chunk in chunks:
+        chunk = to_typed(chunk)
+        yield chunk[list(columns)] if columns is not None else chunk
+
+
+def read_columnar_batches(columnar_path, columns=None, chunk_size=CHUNK_SIZE):
+    types_mapper = {pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}.get
+    parquet_file = pq.ParquetFile(columnar_path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas(types_mapper=types_mapper)
+
+
+def read_pf_tables(
+    path=DATASET_PATH, columns=None, chunk_size=CHUNK_SIZE, columnar=True
+):
+    """
+    Yield typed batches of at most chunk_size rows of the population dataset,
+    with only the given columns (all columns by default). Reads the columnar
+    sibling file if there is an up-to-date one, unless columnar is False.
+    Categories are those present in each batch, so they can differ between
+    batches.
+    """
+    columnar_path = get_columnar_path(path)
+    if columnar and is_current(columnar_path, path):
+        yield from read_columnar_batches(columnar_path, columns, chunk_size)
+    else:
+        yield from read_csv_batches(path, columns, chunk_size)
+
+
+def write_columnar(path=DATASET_PATH, chunk_size=CHUNK_SIZE):
+    """Write the columnar sibling of the population dataset, batch by batch"""
+    columnar_path = get_columnar_path(path)
+    partial_path = columnar_path.with_name(columnar_path.name + ".partial")
+    header = pd.read_csv(path, nrows=0).columns
+    schema = pa.schema([(column, get_arrow_type(column)) for column in header])
+    with pq.ParquetWriter(partial_path, schema) as writer:
+        for batch in read_csv_batches(path, chunk_size=chunk_size):
+            table = pa.Table.from_pandas(batch, preserve_index=False)
+            writer.write_table(table.cast(schema))
+    partial_path.replace(columnar_path)
+    return columnar_path
+
+
+def main():
+    write_columnar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import numpy as np
+
+from local_engine import IntervalGrid, get_registered_population, in_intervals
+
+# The denominator populations of pf_denominators.py as sorted arrays of
+# patient IDs for each interval: registered patients with a sex of male or
+# female, and those of them with a Pharmacy First consultation in the interval.
+# Each interval is resolved once, the first time a grid asks for it, and every
+# local_measures.py definition evaluated with the same EvaluationContext then
+# shares the result, whatever its interval range.
+
+POPULATIONS = ["registered", "pf_consulting"]
+
+
+class PopulationCache:
+    def __init__(self, tables, indexes, pf_events):
+        """
+        indexes are the local_engine.AsOfIndexes of tables; pf_events are the
+        events with a Pharmacy First consultation code, of any date
+        """
+        self.tables = tables
+        self.indexes = indexes
+        self.pf_events = pf_events
+        # (interval_start, interval_end) -> population -> sorted patient IDs
+        self.populations = {}
+
+    def _materialise(self, intervals):
+        missing = intervals[
+            [
+                key not in self.populations
+                for key in zip(intervals["interval_start"], intervals["interval_end"])
+            ]
+        ].reset_index(drop=True)
+        if not len(missing):
+            return
+        grid = IntervalGrid(self.tables["patients"]["patient_id"], missing)
+        _, registered = get_registered_population(grid, self.tables, self.indexes)
+        masks = {
+            "registered": registered,
+            "pf_consulting": registered
+            & grid.exists_for_patient(in_intervals(self.pf_events, missing)),
+        }
+        # Grid rows are ordered by patient, so each interval's IDs are sorted
+        interval = grid.frame["interval"].to_numpy()
+        patient_ids = grid.frame["patient_id"].to_numpy()
+        for position, key in enumerate(
+            zip(missing["interval_start"], missing["interval_end"])
+        ):
+            in_interval = interval == position
+            self.populations[key] = {
+                population: patient_ids[in_interval & mask]
+                for population, mask in masks.items()
+            }
+
+    def mask(self, grid, population):
+        # Whether each grid row's patient is in population for its interval
+        if population not in POPULATIONS:
+            raise ValueError(
+                f"Unknown population {population}, expected one of {POPULATIONS}"
+            )
+        self._materialise(grid.intervals)
+        mask = np.zeros(len(grid), dtype=bool)
+        num_intervals = len(grid.intervals)
+        for position, key in enumerate(
+            zip(grid.intervals["interval_start"], grid.intervals["interval_end"])
+        ):
+            mask[position::num_intervals] = np.isin(
+                grid.patient_ids, self.populations[key][population], assume_unique=True
+            )
+        return mask
+
+    def registered(self, grid):
+        # pf_denominators.registered_population
+        return self.mask(grid, "registered")
+
+    def pf_consulting(self, grid):
+        # pf_denominators.pf_population
+        return self.mask(grid, "pf_consulting")
@@ -0,0 +1,288 @@
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+# Figure- and table-ready datasets for pharmacy_first_report.Rmd and
+# pharmacy_first_monthly_report.Rmd, prepared once from the measures outputs
+# instead of in each report. Labels and factor levels are those of
+# lib/functions/tidy_measures.R and create_tables.R, stored as Parquet
+# dictionaries so the reports read them as factors in the same order. Values
+# that depend on a report's period (label positions, top ten medications) are
+# computed for every interval end, so a report only filters on its dates.
+# The reports read them with lib/functions/load_report_data.R. Inputs are the
+# measures after disclosure_control.py, the only versions that are released.
+#
+# Run with:
+#   python analysis/report_data.py
+# or, locally, against the released outputs:
+#   python analysis/report_data.py --input-dir released_output/disclosure_control
+
+INPUT_DIR = Path("output/disclosure_control")
+OUTPUT_DIR = Path("output/report_data")
+VMP_LOOKUP_PATH = Path("lib/reference/vmp_vtm_lookup.csv")
+
+# Measure name -> label and measure_desc, as in tidy_measures.R
+PF_MEASURES_NAME_DICT = {
+    "pf_consultation_cp_minorillness": "Consultation Service",
+    "pf_consultation_service": "Pharmacy First Consultation",
+    "pf_consultation_cp_service": "Community Pharmacy First Service",
+    "pf_consultation_services_combined": "Pharmacy First Consultations (Combined)",
+    "acute_otitis_media": "Acute Otitis Media",
+    "herpes_zoster": "Herpes Zoster",
+    "acute_sinusitis": "Acute Sinusitis",
+    "impetigo": "Impetigo",
+    "infected_insect_bite": "Infected Insect Bite",
+    "acute_pharyngitis": "Acute Pharyngitis",
+    "uncomplicated_urinary_tract_infection": "UTI",
+}
+PF_MEASURES_NAME_MAPPING = {
+    "pf_consultation_cp_minorillness": "clinical_service",
+    "pf_consultation_service": "clinical_service",
+    "pf_consultation_cp_service": "clinical_service",
+    "pf_consultation_services_combined": "pharmacy_first_services",
+    "acute_otitis_media": "clinical_condition",
+    "herpes_zoster": "clinical_condition",
+    "acute_sinusitis": "clinical_condition",
+    "impetigo": "clinical_condition",
+    "infected_insect_bite": "clinical_condition",
+    "acute_pharyngitis": "clinical_condition",
+    "uncomplicated_urinary_tract_infection": "clinical_condition",
+}
+PF_MEASURES_GROUPBY_DICT = {
+    "age_band": "Age band",
+    "sex": "Sex",
+    "imd": "IMD",
+    "region": "Region",
+    "ethnicity": "Ethnicity",
+}
+
+# Breakdown column -> levels, in display order
+BREAKDOWN_LEVELS = {
+    "ethnicity": [
+        "White",
+        "Mixed",
+        "Asian or Asian British",
+        "Black or Black British",
+        "Chinese or Other Ethnic Groups",
+        "Missing",
+    ],
+    "age_band": ["0-19", "20-39", "40-59", "60-79", "80+", "Missing"],
+    "region": [
+        "East",
+        "East Midlands",
+        "London",
+        "North East",
+        "North West",
+        "South East",
+        "South West",
+        "West Midlands",
+        "Yorkshire and The Humber",
+        "Missing",
+    ],
+}
+SEX_LABELS = {"female": "Female", "male": "Male"}
+
+# Service label -> label with its code, as in generate_pf_consultation_counts
+PF_SERVICE_CODE_LABELS = {
+    "Consultation Service": (
+        "CP Consultation Service for minor illness (1577041000000109)"
+    ),
+    "Pharmacy First Consultation": "Pharmacy First service (983341000000102)",
+    "Community Pharmacy First Service": (
+        "CP Pharmacy First Service (2129921000000100)"
+    ),
+}
+PF_SERVICE_TOTAL_LABEL = "Pharmacy First Service Total"
+
+# Descriptive stats measure -> linkage label, in stacking order
+LINKAGE_LABELS = {
+    "pfmed_with_pfid": "Medication",
+    "pfcondition_with_pfid": "Clinical condition",
+    "pfmed_and_pfcondition_with_pfid": "Both",
+}
+LINKAGE_LEVELS = ["Both", "Clinical condition", "Medication"]
+
+PF_MED_LABELS = {
+    False: "Medication not included in codelists",
+    True: "Medication included in codelists",
+}
+TOP_MEDICATIONS = 10
+
+
+def read_measures(path, **kwargs):
+    return pd.read_csv(path, parse_dates=["interval_start", "interval_end"], **kwargs)
+
+
+def recode(values, mapping):
+    # As R's recode(factor(values), ...): levels are the sorted values, mapped
+    # to their labels, and values without a label are kept
+    levels = pd.Series(sorted(values.dropna().unique()))
+    labels = list(dict.fromkeys(levels.map(lambda value: mapping.get(value, value))))
+    return pd.Categorical(values.map(lambda value: mapping.get(value, value)), labels)
+
+
+def tidy_measures(measures):
+    """
+    Split measure names into summary_stat, measure and group_by, with readable
+    labels and ordered breakdowns, as tidy_measures.R
+    """
+    summary_stat_measure = measures["measure"].str.split("_by_", n=1).str[0]
+    group_by = measures["measure"].str.split("_by_").str[1]
+    summary_stat = summary_stat_measure.str.split("_", n=1).str[0]
+    measure = summary_stat_measure.str.split("_", n=1).str[1]
+
+    tidy = measures.drop(columns="measure")
+    tidy.insert(0, "summary_stat", summary_stat)
+    tidy.insert(1, "measure", recode(measure, PF_MEASURES_NAME_DICT))
+    tidy.insert(2, "group_by", recode(group_by, PF_MEASURES_GROUPBY_DICT))
+    tidy["measure_desc"] = recode(measure, PF_MEASURES_NAME_MAPPING)
+    for column, levels in BREAKDOWN_LEVELS.items():
+        if column in tidy:
+            tidy[column] = pd.Categorical(tidy[column], levels)
+    if "sex" in tidy:
+        tidy["sex"] = pd.Categorical(
+            tidy["sex"].map(SEX_LABELS), list(SEX_LABELS.values())
+        )
+    return tidy
+
+
+def pf_consultation_counts(measures):
+    """
+    Counts of each Pharmacy First service code and their total for every
+    interval, labelled for the consultations figure
+    """
+    services = measures[
+        (measures["measure_desc"] == "clinical_service") & measures["group_by"].isna()
+    ]
+    breakdown = pd.DataFrame(
+        {
+            "measure": services["measure"].astype(str).map(PF_SERVICE_CODE_LABELS),
+            "interval_start": services["interval_start"],
+            "data_desc": "Breakdown",
+            "value": services["numerator"],
+        }
+    )
+    total = (
+        breakdown.groupby("interval_start", as_index=False)["value"]
+        .sum()
+        .assign(measure=PF_SERVICE_TOTAL_LABEL, data_desc="Total")
+    )
+    counts = pd.concat([total, breakdown], ignore_index=True)
+    counts["measure"] = pd.Categorical(
+        counts["measure"],
+        [PF_SERVICE_TOTAL_LABEL, *PF_SERVICE_CODE_LABELS.values()],
+    )
+    counts["data_desc"] = pd.Categorical(counts["data_desc"], ["Total", "Breakdown"])
+    return counts.sort_values(["interval_start", "measure"], ignore_index=True)[
+        ["measure", "interval_start", "data_desc", "value"]
+    ]
+
+
+def linkage(descriptive_stats, consultation_counts):
+    """
+    Share of all Pharmacy First consultations linked to a medication, a
+    condition or both, with the cumulative shares used to position the
+    figure's labels
+    """
+    linked = descriptive_stats[descriptive_stats["measure"].isin(LINKAGE_LABELS)]
+    linked = linked.assign(
+        measure=pd.Categorical(linked["measure"].map(LINKAGE_LABELS), LINKAGE_LEVELS)
+    )
+    totals = consultation_counts.loc[
+        consultation_counts["data_desc"] == "Total", ["interval_start", "value"]
+    ]
+    linked = linked.merge(totals, on="interval_start", how="left")
+    # Stacked from Medication up to Both
+    linked = linked.sort_values(
+        ["interval_start", "measure"], ascending=[True, False], ignore_index=True
+    )
+    linked["ratio_exclusive"] = linked["numerator"] / linked["value"]
+    linked["cumulative_ratio_exclusive"] = linked.groupby("interval_start")[
+        "ratio_exclusive"
+    ].cumsum()
+    return linked
+
+
+def top_medications(med_counts, vmp_lookup):
+    """
+    The most common Pharmacy First medications (VMPs) in consultations from the
+    first interval to each interval's end, with their share of the counts
+    """
+    intervals = pd.MultiIndex.from_frame(
+        med_counts[["interval_start", "interval_end"]]
+        .drop_duplicates()
+        .sort_values("interval_start")
+    )
+    # T/F as written by ehrQL, TRUE/FALSE once tidied in R
+    is_pf_med = med_counts["pharmacy_first_med"].isin(["T", "TRUE"])
+    med_counts = med_counts[is_pf_med & (med_counts["numerator"] > 0)].merge(
+        vmp_lookup, left_on="dmd_code", right_on="id"
+    )
+    monthly = med_counts.pivot_table(
+        index=["interval_start", "interval_end"],
+        columns="vmp_nm",
+        values="numerator",
+        aggfunc="sum",
+        fill_value=0,
+    ).reindex(intervals, fill_value=0)
+    cumulative = monthly.cumsum().stack().rename("count").reset_index()
+    cumulative = cumulative[cumulative["count"] > 0]
+    by_interval = cumulative.groupby("interval_end")["count"]
+    cumulative["ratio_by_group"] = cumulative["count"] / by_interval.transform("sum")
+    # Ties at tenth place are kept, as slice_max
+    rank = by_interval.rank(method="min", ascending=False)
+    top = cumulative[rank <= TOP_MEDICATIONS].drop(columns="interval_start")
+    top.insert(
+        1,
+        "pharmacy_first_med",
+        pd.Categorical([PF_MED_LABELS[True]] * len(top), PF_MED_LABELS.values()),
+    )
+    return top.sort_values(
+        ["interval_end", "count"], ascending=[True, False], ignore_index=True
+    )
+
+
+def write_report_data(data, path):
+    # Dates as dates rather than timestamps, so they are read as R Dates
+    data = data.copy()
+    for column in ["interval_start", "interval_end"]:
+        if column in data:
+            data[column] = pd.to_datetime(data[column]).dt.date
+    data.to_parquet(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", default=INPUT_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    measures_dir = Path(args.input_dir) / "measures"
+    measures = tidy_measures(read_measures(measures_dir / "pf_breakdown_measures.csv"))
+    descriptive_stats = read_measures(
+        measures_dir / "pf_descriptive_stats_measures.csv"
+    )
+    med_counts = read_measures(
+        measures_dir / "pf_medications_measures_tidy.csv",
+        dtype={"dmd_code": str, "pharmacy_first_med": str},
+    )
+    vmp_lookup = pd.read_csv(VMP_LOOKUP_PATH, dtype=str)[["id", "vmp_nm"]].dropna()
+    consultation_counts = pf_consultation_counts(measures)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    write_report_data(measures, output_dir / "measures.parquet")
+    write_report_data(consultation_counts, output_dir / "pf_consultations.parquet")
+    write_report_data(
+        linkage(descriptive_stats, consultation_counts),
+        output_dir / "pf_linkage.parquet",
+    )
+    write_report_data(
+        top_medications(med_counts, vmp_lookup),
+        output_dir / "top_medications.parquet",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+from analysis.dataset_definition_tables import dataset
+from analysis.test_dataset_definition_tables import test_data as hand_written_test_data
+from generated_fixtures import tables_test_data
+
+# Generated test data for dataset_definition_tables.py: a patient for every
+# combination of the parameters in generated_fixtures.tables_patients, with the
+# expected columns from generated_fixtures.reference_tables_columns, after the
+# hand-written patients in test_dataset_definition_tables.py, so that one
+# assure run covers both.
+# Run the following command in the terminal to test the dataset definition
+# opensafely exec ehrql:v1 assure analysis/test_dataset_definition_tables_generated.py
+
+test_data = {
+    **hand_written_test_data,
+    **tables_test_data(first_patient_id=max(hand_written_test_data) + 1),
+}
@@ -0,0 +1,40 @@
+from datetime import date
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import clinical_events, patients
+
+from config import index_date_dataset_tables
+from generated_fixtures import PATHWAY_RULES, numerator_test_data
+from pf_dataset import get_numerator
+import codelists
+
+# Tests get_numerator for every clinical pathway at the dataset_definition_tables.py
+# index date, against generated_fixtures.reference_numerator for a patient for
+# every combination of the parameters in generated_fixtures.numerator_patients.
+# Run the following command in the terminal to test get_numerator
+# opensafely exec ehrql:v1 assure analysis/test_pf_numerators.py
+
+index_date = date.fromisoformat(index_date_dataset_tables)
+
+dataset = create_dataset()
+
+selected_events = clinical_events.where(
+    clinical_events.date.is_on_or_before(index_date)
+)
+
+for clinical_pathway, rules in PATHWAY_RULES.items():
+    dataset.add_column(
+        f"{clinical_pathway}_numerator",
+        get_numerator(
+            index_date,
+            patients,
+            codelists.pregnancy_codelist,
+            selected_events,
+            [rules["code"]],
+            clinical_pathway,
+        ),
+    )
+
+dataset.define_population(patients.exists_for_patient())
+
+test_data = numerator_test_data()
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from disclosure_control import (
+    control_in_chunks,
+    control_measures,
+    get_output_path,
+    get_suppressed,
+    round_counts,
+)
+
+
+def test_round_counts():
+    # Counts of 7 or fewer are 0 and the rest rounded to the nearest 5, halves up
+    rounded = round_counts([0, 7, 8, 12, 13, 22.5, np.nan])
+    assert np.array_equal(rounded, [0, 0, 10, 10, 15, 25, np.nan], equal_nan=True)
+
+
+def test_get_suppressed_single_count_in_group():
+    # The only small count in group 0 is recoverable from the total, so the
+    # smallest count above the threshold is suppressed too; group 1 has two
+    # small counts, and zeros are not suppressed
+    values = [3, 20, 10, 50, 2, 5, 30, 0]
+    groups = [0, 0, 0, 0, 1, 1, 1, 1]
+    assert list(get_suppressed(values, groups)) == [
+        True,
+        False,
+        True,
+        False,
+        True,
+        True,
+        False,
+        False,
+    ]
+
+
+def test_get_suppressed_without_secondary_candidate():
+    values = [3, 0, 7, 9]
+    groups = [0, 0, 1, 2]
+    assert list(get_suppressed(values, groups)) == [True, False, True, False]
+
+
+def write_measures(path, numerators, intervals):
+    pd.DataFrame(
+        {
+            "measure": "count",
+            "interval_start": intervals,
+            "interval_end": intervals,
+            "ratio": "",
+            "numerator": numerators,
+            "denominator": 100,
+        }
+    ).to_csv(path, index=False)
+
+
+def test_control_in_chunks_group_across_chunk_boundary(tmp_path):
+    # The 2024-01-01 group runs over the first chunk of two rows
+    write_measures(
+        tmp_path / "measures.csv",
+        [3, 20, 10, 40, 50],
+        ["2024-01-01"] * 3 + ["2024-02-01"] * 2,
+    )
+    control_in_chunks(
+        tmp_path / "measures.csv",
+        tmp_path / "controlled.csv",
+        control_measures,
+        ["measure", "interval_start", "interval_end"],
+        chunk_size=2,
+    )
+    controlled = pd.read_csv(tmp_path / "controlled.csv")
+    assert list(controlled["numerator"]) == [0, 20, 0, 40, 50]
+    assert list(controlled["ratio"]) == [0, 0.2, 0, 0.4, 0.5]
+
+
+def test_control_in_chunks_rejects_split_groups(tmp_path):
+    write_measures(
+        tmp_path / "measures.csv",
+        [3, 20, 10],
+        ["2024-01-01", "2024-02-01", "2024-01-01"],
+    )
+    with pytest.raises(ValueError, match="must be next to each other"):
+        control_in_chunks(
+            tmp_path / "measures.csv",
+            tmp_path / "controlled.csv",
+            control_measures,
+            ["measure", "interval_start", "interval_end"],
+            chunk_size=2,
+        )
+
+
+def test_get_output_path():
+    # The ehrQL and pf_consultations.py measures share file names
+    assert get_output_path("output/measures/pf_breakdown_measures.csv") == Path(
+        "output/disclosure_control/measures/pf_breakdown_measures.csv"
+    )
+    assert get_output_path(
+        "output/pf_consultations/measures/pf_breakdown_measures.csv"
+    ) == Path(
+        "output/disclosure_control/pf_consultations/measures/pf_breakdown_measures.csv"
+    )
+    assert get_output_path("released/rollup/pf_counts_weekly.csv") == Path(
+        "output/disclosure_control/rollup/pf_counts_weekly.csv"
+    )
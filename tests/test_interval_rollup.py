@@ -0,0 +1,21 @@
+import pandas as pd
+
+from interval_rollup import get_rollup_intervals
+
+
+def test_weekly_intervals_are_iso_weeks():
+    # 2023-11-01 is a Wednesday, so the first whole ISO week starts on the 6th
+    intervals = get_rollup_intervals("weekly", "2023-11-01", 2)
+    assert intervals["interval_start"].iloc[0] == pd.Timestamp("2023-11-06")
+    assert (intervals["interval_start"].dt.dayofweek == 0).all()
+    assert intervals["interval_end"].iloc[-1] == pd.Timestamp("2023-12-31")
+
+
+def test_quarterly_intervals_are_calendar_quarters():
+    intervals = get_rollup_intervals("quarterly", "2023-11-01", 9)
+    assert list(intervals["interval_start"]) == list(
+        pd.to_datetime(["2024-01-01", "2024-04-01"])
+    )
+    assert list(intervals["interval_end"]) == list(
+        pd.to_datetime(["2024-03-31", "2024-06-30"])
+    )
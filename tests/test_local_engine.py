@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from local_engine import (
+    IntervalGrid,
+    SparseIntervalGrid,
+    get_intervals,
+    in_intervals,
+    to_output_values,
+)
+
+
+def dates(*values):
+    return pd.to_datetime(list(values))
+
+
+def test_get_intervals():
+    # Each interval starts the same number of months after the start date,
+    # rolling forward where that day does not exist
+    intervals = get_intervals("2024-01-31", 2)
+    assert list(intervals["interval_start"]) == list(dates("2024-01-31", "2024-03-01"))
+    assert list(intervals["interval_end"]) == list(dates("2024-02-29", "2024-03-30"))
+
+
+def test_in_intervals():
+    intervals = pd.DataFrame(
+        {
+            "interval_start": dates("2024-01-01", "2024-03-01"),
+            "interval_end": dates("2024-01-31", "2024-03-31"),
+        }
+    )
+    events = pd.DataFrame(
+        {
+            "patient_id": range(7),
+            "date": dates(
+                "2023-12-31",
+                "2024-01-01",
+                "2024-01-31",
+                "2024-02-15",
+                "2024-03-31",
+                "2024-04-01",
+                None,
+            ),
+        }
+    )
+    result = in_intervals(events, intervals)
+    assert list(result["patient_id"]) == [1, 2, 4]
+    assert list(result["interval"]) == [0, 0, 1]
+
+
+def test_first_for_patient_ties():
+    intervals = get_intervals("2024-01-01", 1)
+    grid = IntervalGrid([1, 2, 3], intervals)
+    events = in_intervals(
+        pd.DataFrame(
+            {
+                "patient_id": [1, 1, 1, 2, 2],
+                "date": dates(
+                    "2024-01-20", "2024-01-10", "2024-01-10", "2024-01-05", "2024-01-05"
+                ),
+                "code": ["late", "first tie", "second tie", "a", "b"],
+            }
+        ),
+        intervals,
+    )
+    # Of events with the same sort value, the first in events is the first
+    # for the patient and the last in events is the last
+    first = grid.first_for_patient(events, "date", "code")
+    assert list(first) == ["first tie", "a", None]
+    last = grid.first_for_patient(events, "date", "code", last=True)
+    assert list(last) == ["late", "b", None]
+
+
+def test_sparse_interval_grid():
+    intervals = get_intervals("2024-01-01", 3)
+    events = in_intervals(
+        pd.DataFrame(
+            {
+                "patient_id": [2, 1, 2, 2],
+                "date": dates("2024-03-05", "2024-01-10", "2024-01-02", "2024-03-20"),
+            }
+        ),
+        intervals,
+    )
+    grid = SparseIntervalGrid(events, intervals)
+    assert list(zip(grid.frame["patient_id"], grid.frame["interval"])) == [
+        (1, 0),
+        (2, 0),
+        (2, 2),
+    ]
+    assert list(grid.count_for_patient(events)) == [1, 1, 2]
+    # Pairs without events have no row
+    other = pd.DataFrame({"patient_id": [1, 3], "interval": [1, 0]})
+    assert list(grid.rows(other)) == [-1, -1]
+
+
+def test_to_output_values():
+    assert list(to_output_values([True, False, None])) == ["T", "F", ""]
+    assert list(to_output_values(np.array([True, False]))) == ["T", "F"]
+    assert list(to_output_values(["40-59", None, "Missing"])) == [
+        "40-59",
+        "",
+        "Missing",
+    ]
+    assert list(to_output_values(pd.array([123, None], dtype="Int64"))) == ["123", ""]
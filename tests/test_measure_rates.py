@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from measure_rates import add_rates, measure_rates
+
+
+def get_measures(starts, numerators):
+    starts = pd.to_datetime(starts)
+    return pd.DataFrame(
+        {
+            "measure": "count",
+            "interval_start": starts.strftime("%Y-%m-%d"),
+            "interval_end": (starts + pd.offsets.MonthEnd()).strftime("%Y-%m-%d"),
+            "ratio": "",
+            "numerator": [str(value) for value in numerators],
+            "denominator": "1000",
+        }
+    )
+
+
+def test_changes_and_rolling_means_skip_missing_months():
+    # March to May are missing (e.g. empty denominators), so June has no
+    # previous month and no full window
+    measures = get_measures(["2024-01-01", "2024-02-01", "2024-06-01"], [10, 12, 40])
+    result = add_rates(measures, [], window=2)
+    assert np.array_equal(
+        result["numerator_change"], [np.nan, 2, np.nan], equal_nan=True
+    )
+    assert np.array_equal(
+        result["numerator_rolling_mean"], [np.nan, 11, np.nan], equal_nan=True
+    )
+
+
+def test_rolling_means_across_chunks(tmp_path):
+    starts = ["2024-01-01", "2024-02-01", "2024-03-01", "2024-05-01", "2024-06-01"]
+    get_measures(starts, [10, 12, 14, 20, 22]).to_csv(
+        tmp_path / "measures.csv", index=False
+    )
+    measure_rates(tmp_path / "measures.csv", tmp_path / "rates.csv", chunk_size=2)
+    result = pd.read_csv(tmp_path / "rates.csv")
+    assert np.array_equal(
+        result["numerator_change"], [np.nan, 2, 2, np.nan, 2], equal_nan=True
+    )
+    assert np.array_equal(
+        result["numerator_rolling_mean"],
+        [np.nan, np.nan, 12, np.nan, np.nan],
+        equal_nan=True,
+    )
@@ -0,0 +1,29 @@
+import pytest
+
+from measure_shards import add_months, get_interval_shards
+
+
+def test_add_months():
+    assert add_months("2024-05-15", -1) == "2024-04-15"
+    assert add_months("2024-03-29", -1) == "2024-02-29"
+    assert add_months("2024-01-01", -1) == "2023-12-01"
+    assert add_months("2023-11-30", 14) == "2025-01-30"
+
+
+def test_add_months_rolls_missing_days_forward():
+    # There is no 31 February, 29 February 2023 or 31 April, so as in ehrQL
+    # the result is the first day of the following month
+    assert add_months("2024-03-31", -1) == "2024-03-01"
+    assert add_months("2023-03-29", -1) == "2023-03-01"
+    assert add_months("2024-05-31", -1) == "2024-05-01"
+    assert add_months("2024-01-31", 1) == "2024-03-01"
+    assert add_months("2023-08-31", 1) == "2023-10-01"
+
+
+def test_get_interval_shards():
+    assert get_interval_shards("2024-01-31", 5, 2) == [
+        ("2024-01-31", 3),
+        ("2024-05-01", 2),
+    ]
+    with pytest.raises(ValueError):
+        get_interval_shards("2024-01-01", 2, 3)